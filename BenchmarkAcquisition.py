@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+BenchmarkAcquisition.py | David Haberthür <david.haberthuer@psi.ch>
+
+Script to benchmark the acquisition loop without the hardware. We run the
+first images of the Hamamatsu plan on the simulated gantry, with the
+latencies of the time model in acquisitionplan, once strictly one after the
+other, once with the readout overlapped with the next source change and once
+with the SettleDetector, and compare how long each run took with the
+predicted time. The detector needs a second to start each exposure, and
+we count the images during whose exposure the source was changed.
+Start it with the number of images to acquire per run (default 5).
+"""
+
+import sys
+import tempfile
+import time
+import shutil
+
+import acquisitionplan
+from acquisitionrunner import AcquisitionRunner
+from settledetector import SettleDetector
+from simulatedgantry import sb, tube
+
+DetectorExposureTime = 1
+try:
+    Images = int(sys.argv[1])
+except (IndexError, ValueError):
+    Images = 5
+Settings, Dropped = acquisitionplan.plan(range(25, 65), range(10, 201, 5),
+                                         seed=1)
+Settings = Settings[:Images]
+
+# The simulated hardware is as slow as our time model says
+sb.readouttime = acquisitionplan.ReadoutTime
+sb.exposureoverhead = 1
+tube.rampvoltage = acquisitionplan.RampVoltage
+tube.rampcurrent = acquisitionplan.RampCurrent
+tube.on()
+sb.start()
+sb.set_exposure_time(DetectorExposureTime * 1000)
+
+
+def set_tube(setting):
+    voltage, current = setting
+    tube.set_voltage(voltage)
+    tube.set_current(current)
+    return voltage, current
+
+Results = []
+for method in ('sequential', 'overlap', 'adaptive'):
+    print 80 * '-'
+    print 'Acquiring %s images (%s)' % (len(Settings), method)
+    OutPutPath = tempfile.mkdtemp()
+    sb.corrupted = []
+    Runner = AcquisitionRunner(
+        sb, 'Hamamatsu', OutPutPath, DetectorExposureTime, set_tube,
+        settletime=acquisitionplan.SettleTime,
+        settler=SettleDetector(sb, OutPutPath, DetectorExposureTime,
+                               probeexposure=0.2,
+                               ceiling=acquisitionplan.SettleTime)
+        if method == 'adaptive' else None,
+        overlap=method != 'sequential')
+    start = time.time()
+    Failed = Runner.run(Settings)
+    Results.append((method, time.time() - start,
+                    acquisitionplan.predicted_time(
+                        Settings, DetectorExposureTime,
+                        overlap=method != 'sequential'), len(Failed),
+                    len(sb.corrupted)))
+    print 'Time spent in each stage:'
+    Runner.summary()
+    shutil.rmtree(OutPutPath)
+
+print 80 * '-'
+for method, measured, predicted, failed, corrupted in Results:
+    print '%s: %0.1f s (predicted %0.1f s), %s incomplete and %s corrupted ' \
+          'images' % (method, measured, predicted, failed, corrupted)
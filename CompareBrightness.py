@@ -9,12 +9,16 @@ Hamamatsu
 
 # Imports
 import os
-import glob
 import matplotlib.pylab as plt
 from matplotlib.patches import Rectangle
 from scipy import stats
 
 from ERIfunctions import *
+import imagecatalog
+from imagestatistics import ImageStats
+from defectpixels import load_defect_map, defect_replacement
+from previewcache import show_preview
+from metricsstore import MetricsStore
 
 # Reset markers from standard
 #~ plt.rc('lines', linewidth=2, marker='o')
@@ -31,8 +35,10 @@ if Ubuntu:
 else:
     StartPath = '/sls/X02DA/data/e13960/Data20/Gantry/Images'
 
+# Read (and update) the catalog of all images
+Catalog = imagecatalog.scan(StartPath)
 # Filter list for only 'Grid' folders: http://stackoverflow.com/a/4260304
-FolderList = sorted(os.walk(StartPath).next()[1])
+FolderList = imagecatalog.folders(Catalog)
 # Filter list to remove the folders to disregard
 FolderList = [i if 'DoNotUse' not in i else '' for i in FolderList]
 # Only show these folders (Wrench, Grid, Current)
@@ -46,55 +52,56 @@ HamamatsuFolders = [x for x in HamamatsuFolders if x]
 ChosenERI = ask_user('Which ERI folder shall we use?', ERIFolders)
 ChosenHamamatsu = ask_user('Which Hamamatsu folder shall we use to compare with %s?' % bold(ChosenERI), HamamatsuFolders)
 
+# Replace the defective pixels found by DarkImages.py in all images
+DefectMapFile = os.path.join(StartPath, 'Darks', 'DefectMap.npz')
+if os.path.exists(DefectMapFile):
+    Defects = defect_replacement(load_defect_map(DefectMapFile))
+    print 'Replacing %s defective pixels in all images' % len(Defects[0][0])
+else:
+    Defects = None
+
 # Prepare output directory
 OutputPath = os.path.join(os.path.expanduser('~'), 'Data20', 'CNT',
                           'ERI-Analysis', 'Images', 'Brightness-Comparison')
-try:
-    os.makedirs(OutputPath)
-except OSError:
-    # Directory already exists
-    pass
+make_directory(OutputPath)
 
 # Grab Voltage and Current for ERI
-ImageListERI = sorted(glob.glob(os.path.join(StartPath, ChosenERI, '*.raw')))
+CatalogERI = imagecatalog.select(Catalog, folder=ChosenERI)
+ImageListERI = imagecatalog.filenames(CatalogERI, StartPath)
 print 'Reading Parameters from %s images in %s' % (len(ImageListERI),
                                                    bold(ChosenERI))
-VoltageERI = [int(os.path.basename(i).split('_')[1][:-2]) for i in ImageListERI]
-CurrentERI = [int(os.path.basename(i).split('_')[2][:-2]) for i in ImageListERI]
+VoltageERI = list(CatalogERI['voltage'])
+CurrentERI = list(CatalogERI['current'])
 
 # Grab Voltage and Current for Hamamatsu
-ImageListHamamatsu = sorted(glob.glob(os.path.join(StartPath, ChosenHamamatsu,
-                                                   '*.raw')))
-
+CatalogHamamatsu = imagecatalog.select(Catalog, folder=ChosenHamamatsu)
+ImageListHamamatsu = imagecatalog.filenames(CatalogHamamatsu, StartPath)
 print 'Reading Parameters from %s images in %s' % (len(ImageListHamamatsu),
                                                    bold(ChosenHamamatsu))
-VoltageHamamatsu = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                    ImageListHamamatsu]
-CurrentHamamatsu = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                    ImageListHamamatsu]
+VoltageHamamatsu = list(CatalogHamamatsu['voltage'])
+CurrentHamamatsu = list(CatalogHamamatsu['current'])
 
 # Grab closest values from the Hamamatsu dataset and plot them afterwards
 plt.ion()
 plt.figure(figsize=[8, 6])
+print 'Looking for best matching currents from Hamamatsu for %s images' % \
+    len(ImageListERI)
+Found, Matches = best_matches(VoltageERI, CurrentERI, VoltageHamamatsu,
+                              CurrentHamamatsu, ImageListERI)
+# We only compare the ERI images we found a match for
+CatalogERI = CatalogERI[Found]
+ImageListERI = [ImageListERI[f] for f in Found]
+VoltageERI = [VoltageERI[f] for f in Found]
+CurrentERI = [CurrentERI[f] for f in Found]
 CompareImages = []
 for c, i in enumerate(ImageListERI):
-    print 'Looking for best matching current from Hamamatsu for %s (%s kV, %s mA)' % (os.path.basename(i), VoltageERI[c], CurrentERI[c])
-    Candidates = []
-    for k in ImageListHamamatsu:
-        if str(VoltageERI[c]) + 'kV' in k:
-            Candidates.append(k)
-    IndexList = [ImageListHamamatsu.index(i) for i in Candidates]
-    # Get the closest value to the current from Hamamatsu list. Based on
-    # http://stackoverflow.com/a/9706105/323100
-    ChosenOne = min(enumerate([CurrentHamamatsu[i] for i in IndexList]),
-                    key=lambda x: abs(x[1] - CurrentERI[c]))
-    print '\tFound a match in %s' % os.path.basename(Candidates[ChosenOne[0]])
-    CompareImages.append(Candidates[ChosenOne[0]])
+    print '\tFound a match for %s (%s kV, %s uA) in %s' % (
+        os.path.basename(i), VoltageERI[c], CurrentERI[c],
+        os.path.basename(ImageListHamamatsu[Matches[c]]))
+    CompareImages.append(ImageListHamamatsu[Matches[c]])
 
-VoltageMatch = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                CompareImages]
-CurrentMatch = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                CompareImages]
+VoltageMatch = [parse_settings(i)[1] for i in CompareImages]
+CurrentMatch = [parse_settings(i)[2] for i in CompareImages]
 
 plt.scatter(VoltageHamamatsu, CurrentHamamatsu, c=colors[0], alpha=0.309,
             label='Hamamatsu')
@@ -112,29 +119,41 @@ plt.savefig(os.path.join(OutputPath, 'Match-' +
                          os.path.basename(os.path.dirname(ImageListERI[0])) +
                          '.png'))
 
+
+def brightness(filename):
+    """
+    Mean and STD of one image, for the metrics store
+    """
+    Stats = ImageStats(read_raw(filename, defects=Defects))
+    return {'mean': Stats.mean, 'std': Stats.std(ddof=0)}, {}
+
+# Get brightness and STD of the comparable images from the metrics store. We
+# only calculate them for the images we have not looked at before.
+BrightnessVersion = '1' if Defects is None else '1-defects'
+Store = MetricsStore(os.path.join(StartPath, 'Metrics.sqlite'))
+Store.update(CatalogERI, StartPath, 'brightness', BrightnessVersion,
+             brightness, verbose=True)
+Store.update(CatalogHamamatsu[Matches], StartPath, 'brightness',
+             BrightnessVersion, brightness, verbose=True)
+BrightnessERI = list(Store.values(ImageListERI, 'brightness',
+                                  BrightnessVersion, 'mean'))
+STDERI = list(Store.values(ImageListERI, 'brightness', BrightnessVersion,
+                           'std'))
+BrightnessHamamatsu = list(Store.values(CompareImages, 'brightness',
+                                        BrightnessVersion, 'mean'))
+STDHamamatsu = list(Store.values(CompareImages, 'brightness',
+                                 BrightnessVersion, 'std'))
+Store.close()
+
 # Plot brightness of the comparable images in one plot
-BrightnessHamamatsu = []
-BrightnessERI = []
-STDERI = []
-STDHamamatsu = []
-DisplayProgress = True
 plt.figure(figsize=[20, 9])
-for c, i in enumerate(CompareImages):
-    print '%s/%s: Comparing %s with %s' % (c + 1, len(CompareImages),
-                                           os.path.basename(ImageListERI[c]),
-                                           os.path.basename(i))
-    ImageERI = read_raw(ImageListERI[c])
-    ImageHamamatsu = read_raw(i)
-    BrightnessERI.append(numpy.mean(ImageERI))
-    STDERI.append(numpy.std(ImageERI, axis=None, ddof=0))
-    BrightnessHamamatsu.append(numpy.mean(ImageHamamatsu))
-    STDHamamatsu.append(numpy.std(ImageHamamatsu, axis=None, ddof=0))
 
 # Scale with transmission, according to http://web-docs.gsi.de/~stoe_exp/web_programs/x_ray_absorption/index.php
 Scale = True
 if Scale:
-    Beryllium = numpy.linspace(0.9945, 0.9959, len(BrightnessHamamatsu))
-    SiO2 = numpy.linspace(0.7370, 0.9538, len(BrightnessERI))
+    # Transmission at 25 and 64 kV, in between we interpolate
+    Beryllium = numpy.interp(VoltageERI, [25, 64], [0.9945, 0.9959])
+    SiO2 = numpy.interp(VoltageERI, [25, 64], [0.7370, 0.9538])
     BrightnessERI = BrightnessERI / SiO2
     BrightnessHamamatsu = BrightnessHamamatsu / Beryllium
     STDERI = STDERI / SiO2
@@ -148,35 +167,35 @@ else:
 
 BrightnessRatio = [a / b for a, b in zip(BrightnessHamamatsu, BrightnessERI)]
 
-# Plot Brightness with kV as x-axis (Image 0 is 25 kV)
+# Plot Brightness with kV as x-axis
 plt.subplot(241)
 # First plot brightness values ± STD
 currentplot = plt.gca()
-currentplot.fill_between(range(25, 25 + len(BrightnessERI)), BrightnessERI + STDERI, BrightnessERI - STDERI, facecolor=colors[0], edgecolor='w', alpha=0.309)
-currentplot.fill_between(range(25, 25 + len(BrightnessHamamatsu)), BrightnessHamamatsu + STDHamamatsu, BrightnessHamamatsu - STDHamamatsu, facecolor=colors[1], edgecolor='w', alpha=0.309)
+currentplot.fill_between(VoltageERI, BrightnessERI + STDERI, BrightnessERI - STDERI, facecolor=colors[0], edgecolor='w', alpha=0.309)
+currentplot.fill_between(VoltageERI, BrightnessHamamatsu + STDHamamatsu, BrightnessHamamatsu - STDHamamatsu, facecolor=colors[1], edgecolor='w', alpha=0.309)
 # Then plot a marker for the minimal, maximal and median images
-plt.plot(25 + BrightnessRatio.index(min(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(min(BrightnessRatio))],
          BrightnessERI[BrightnessRatio.index(min(BrightnessRatio))],
          color=colors[2], marker='o', markersize=15)
-plt.plot(25 + BrightnessRatio.index(min(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(min(BrightnessRatio))],
          BrightnessHamamatsu[BrightnessRatio.index(min(BrightnessRatio))],
          color=colors[2], marker='o', markersize=15)
-plt.plot(25 + BrightnessRatio.index(numpy.median(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(numpy.median(BrightnessRatio))],
          BrightnessERI[BrightnessRatio.index(numpy.median(BrightnessRatio))],
          color=colors[3], marker='o', markersize=15)
-plt.plot(25 + BrightnessRatio.index(numpy.median(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(numpy.median(BrightnessRatio))],
          BrightnessHamamatsu[BrightnessRatio.index(numpy.median(BrightnessRatio))],
          color=colors[3], marker='o', markersize=15)
-plt.plot(25 + BrightnessRatio.index(max(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(max(BrightnessRatio))],
          BrightnessERI[BrightnessRatio.index(max(BrightnessRatio))],
          color=colors[4], marker='o', markersize=15)
-plt.plot(25 + BrightnessRatio.index(max(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(max(BrightnessRatio))],
          BrightnessHamamatsu[BrightnessRatio.index(max(BrightnessRatio))],
          color=colors[4], marker='o', markersize=15)
 # Finally plot the brightness values on top of that
-plt.plot(range(25, 25 + len(BrightnessERI)), BrightnessERI, c=colors[0],
+plt.plot(VoltageERI, BrightnessERI, c=colors[0],
          label=r'%s $\pm$ STD' % os.path.basename(os.path.dirname(ImageListERI[0])))
-plt.plot(range(25, 25 + len(BrightnessHamamatsu)), BrightnessHamamatsu,
+plt.plot(VoltageERI, BrightnessHamamatsu,
          c=colors[1], label=r'%s $\pm$ STD' % os.path.basename(os.path.dirname(ImageListHamamatsu[0])))
 plt.xlim([20, 70])
 plt.ylim([0, 2 ** 12])
@@ -190,15 +209,15 @@ plt.legend(loc='best')
 
 # Plot Ratio with kV as x-axis (Image 0 is 25 kV)
 plt.subplot(245)
-plt.plot(range(25, 25 + len(BrightnessERI)), BrightnessRatio, 'k',
+plt.plot(VoltageERI, BrightnessRatio, 'k',
          label='Hamamatsu / ERI')
-plt.plot(25 + BrightnessRatio.index(min(BrightnessRatio)), min(BrightnessRatio),
+plt.plot(VoltageERI[BrightnessRatio.index(min(BrightnessRatio))], min(BrightnessRatio),
          color=colors[2], marker='o', markersize=15, alpha=0.309,
          label='Minimal difference (%0.2fx)' % min(BrightnessRatio))
-plt.plot(25 + BrightnessRatio.index(numpy.median(BrightnessRatio)),
+plt.plot(VoltageERI[BrightnessRatio.index(numpy.median(BrightnessRatio))],
          numpy.median(BrightnessRatio), color=colors[3], marker='o', markersize=15,
          alpha=0.309, label='Median difference (%0.2fx)' % numpy.median(BrightnessRatio))
-plt.plot(25 + BrightnessRatio.index(max(BrightnessRatio)), max(BrightnessRatio),
+plt.plot(VoltageERI[BrightnessRatio.index(max(BrightnessRatio))], max(BrightnessRatio),
          color=colors[4], marker='o', markersize=15, alpha=0.309,
          label='Maximal difference (%0.2fx)' % max(BrightnessRatio))
 plt.xlim([20, 70])
@@ -210,38 +229,38 @@ plt.title('Brightness difference')
 # Show images from min, max and median
 plt.subplot(242)
 plt.title('Minimal difference image Hamamatsu\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(CompareImages[BrightnessRatio.index(min(BrightnessRatio))])))
+show_preview(CompareImages[BrightnessRatio.index(min(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[2], alpha=0.309))
 plt.axis('off')
 plt.subplot(246)
 plt.title('Minimal difference image ERI\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(ImageListERI[BrightnessRatio.index(min(BrightnessRatio))])))
+show_preview(ImageListERI[BrightnessRatio.index(min(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[2], alpha=0.309))
 plt.axis('off')
 plt.subplot(243)
 plt.title('Median difference image Hamamatsu\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(CompareImages[BrightnessRatio.index(numpy.median(BrightnessRatio))])))
+show_preview(CompareImages[BrightnessRatio.index(numpy.median(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[3], alpha=0.309))
 plt.axis('off')
 plt.subplot(247)
 plt.title('Median difference image ERI\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(ImageListERI[BrightnessRatio.index(
-    numpy.median(BrightnessRatio))])))
+show_preview(ImageListERI[BrightnessRatio.index(
+    numpy.median(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[3], alpha=0.309))
 plt.axis('off')
 plt.subplot(244)
 plt.title('Maximal difference image Hamamatsu\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(CompareImages[BrightnessRatio.index(max(BrightnessRatio))])))
+show_preview(CompareImages[BrightnessRatio.index(max(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[4], alpha=0.309))
 plt.axis('off')
 plt.subplot(248)
 plt.title('Maximal difference image ERI\n(contrast stretched)')
-plt.imshow(contrast_stretch(read_raw(ImageListERI[BrightnessRatio.index(max(BrightnessRatio))])))
+show_preview(ImageListERI[BrightnessRatio.index(max(BrightnessRatio))], defects=Defects)
 currentAxis = plt.gca()
 currentAxis.add_patch(Rectangle((0, 0), 2048, 1024, color=colors[4], alpha=0.309))
 plt.axis('off')
@@ -49,49 +49,31 @@ OutputPath = os.path.join(os.path.expanduser('~'), 'Data20', 'CNT',
                           'Comparison-' +
                           os.path.basename(ChosenERI) + '_VS_' +
                           os.path.basename(ChosenHamamatsu))
-try:
-    os.makedirs(OutputPath)
-except OSError:
-    # Directory already exists
-    pass
+make_directory(OutputPath)
 
 ImageListERI = sorted(glob.glob(os.path.join(StartPath, ChosenERI, '*.png')))
 print 'Reading Parameters from %s images in %s' % (len(ImageListERI),
                                                    bold(ChosenERI))
-VoltageERI = [int(os.path.basename(i).split('_')[1][:-2]) for i in ImageListERI]
-CurrentERI = [int(os.path.basename(i).split('_')[2][:-2]) for i in ImageListERI]
+VoltageERI = [parse_settings(i)[1] for i in ImageListERI]
+CurrentERI = [parse_settings(i)[2] for i in ImageListERI]
 
 ImageListHamamatsu = sorted(glob.glob(os.path.join(StartPath, ChosenHamamatsu,
                                                    '*.png')))
 print 'Reading Parameters from %s images in %s' % (len(ImageListERI),
                                                    bold(ChosenHamamatsu))
-VoltageHamamatsu = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                    ImageListHamamatsu]
-CurrentHamamatsu = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                    ImageListHamamatsu]
+VoltageHamamatsu = [parse_settings(i)[1] for i in ImageListHamamatsu]
+CurrentHamamatsu = [parse_settings(i)[2] for i in ImageListHamamatsu]
 
 # Grab closest values from the Hamamatsu data set and plot them afterwards
-CompareImages = []
-for c, i in enumerate(ImageListERI):
-    # print 80 * '-'
-    # print 'Finding best matching current from Hamamatsu for %s (%s kV, ' \
-    #       '%s mA)' % (i, VoltageERI[c], CurrentERI[c])
-    Candidates = []
-    for k in ImageListHamamatsu:
-        if str(VoltageERI[c]) + 'kV' in k:
-            Candidates.append(k)
-    IndexList = [ImageListHamamatsu.index(i) for i in Candidates]
-    # Get the closest value to the current from Hamamatsu list. Based on
-    # http://stackoverflow.com/a/9706105/323100
-    ChosenOne = min(enumerate([CurrentHamamatsu[i] for i in IndexList]),
-                    key=lambda x: abs(x[1] - CurrentERI[c]))
-    # print 'Found a match in %s' % Candidates[ChosenOne[0]]
-    CompareImages.append(Candidates[ChosenOne[0]])
-# print 80 * '-'
-VoltageMatch = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                CompareImages]
-CurrentMatch = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                CompareImages]
+Found, Matches = best_matches(VoltageERI, CurrentERI, VoltageHamamatsu,
+                              CurrentHamamatsu, ImageListERI)
+# We only compare the ERI images we found a match for
+ImageListERI = [ImageListERI[f] for f in Found]
+VoltageERI = [VoltageERI[f] for f in Found]
+CurrentERI = [CurrentERI[f] for f in Found]
+CompareImages = [ImageListHamamatsu[m] for m in Matches]
+VoltageMatch = [parse_settings(i)[1] for i in CompareImages]
+CurrentMatch = [parse_settings(i)[2] for i in CompareImages]
 
 # Display results
 plt.ion()
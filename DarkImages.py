@@ -13,6 +13,9 @@ import glob
 import matplotlib.pylab as plt
 
 from ERIfunctions import *
+from imagestatistics import image_statistics
+from defectpixels import defect_map, save_defect_map
+from masterframes import cached_master_frame
 
 # Colors from 'I want hue'
 colors = ["#84DEBD", "#D1B9D4", "#D1D171"]
@@ -28,16 +31,35 @@ else:
 DarkNames = sorted(glob.glob(os.path.join(StartPath, '*.raw')))
 if not DarkNames:
     exit('No dark images found, is "%s" the correct directory?' % StartPath)
-print 'Reading in %s images in %s' % (len(DarkNames), StartPath)
-DarkImages = [read_raw(i) for i in DarkNames]
+# Calculating values while reading the images in chunks
+print 'Reading in %s images in %s and calculating average dark image, ' \
+      'mean (brightness) and gray value STD' % (len(DarkNames), StartPath)
+Statistics = image_statistics(DarkNames, verbose=True)
+MeanImage = Statistics.mean
+Brightness = Statistics.framemean
+STD = Statistics.framestd
 
-# Calculating values
-print 'Calculating average dark image'
-MeanImage = numpy.mean(DarkImages, axis=0)
-print 'Extracting mean (brightness) of %s raw images' % len(DarkNames)
-Brightness = [numpy.mean(i) for i in DarkImages]
-print 'Extracting gray value STD of %s raw images' % len(DarkNames)
-STD = [numpy.std(i) for i in DarkImages]
+# The flats show us the dead and overly sensitive pixels, which we cannot see
+# in the darks
+FlatFolders = sorted(f for f in glob.glob(os.path.join(os.path.dirname(
+    StartPath), '*')) if os.path.isdir(f) and f != StartPath)
+if not FlatFolders:
+    exit('No folder with flats found next to "%s"' % StartPath)
+FlatFolder = ask_user('From which folder should we load the flats?',
+                      FlatFolders)
+FlatNames = sorted(glob.glob(os.path.join(FlatFolder, '*.raw')))
+if not FlatNames:
+    exit('No flat images found in "%s"' % FlatFolder)
+print 'Calculating average of %s flat images in %s' % (len(FlatNames),
+                                                       FlatFolder)
+MeanFlat = cached_master_frame(FlatNames, verbose=True)
+
+# Find the hot, noisy, dead and overly sensitive pixels and save them for the
+# other scripts
+DefectMap = defect_map(MeanImage, darkstd=Statistics.std(), flatmean=MeanFlat)
+save_defect_map(os.path.join(StartPath, 'DefectMap.npz'), DefectMap)
+print 'Found %s defective pixels, saved to %s' % (
+    numpy.sum(DefectMap), os.path.join(StartPath, 'DefectMap.npz'))
 
 plt.figure(figsize=[16, 9])
 plt.subplot(221)
@@ -46,7 +68,7 @@ plt.title('Average dark image with a min of %s and a max of'
           ' %s' % (numpy.min(MeanImage), numpy.max(MeanImage)))
 plt.subplot(222)
 std = 3
-plt.imshow(contrast_stretch(MeanImage, std=std))
+plt.imshow(display_image(MeanImage, std=std), vmin=0, vmax=255)
 plt.title('Contrast stretched average dark (mean +- %s STD)' % std)
 plt.subplot(223)
 plt.plot(Brightness, c=colors[0], label='Image mean (%0.2f-%0.2f)' % (
@@ -56,7 +78,7 @@ plt.axhline(numpy.mean(MeanImage), c=colors[1], alpha=0.5,
 plt.axhline(numpy.mean(Brightness), c=colors[2], alpha=0.5,
             label='Mean of Brightness: %0.2f' % numpy.mean(Brightness))
 plt.legend(loc='best')
-plt.title('Brightness of %s images' % len(DarkImages))
+plt.title('Brightness of %s images' % len(DarkNames))
 plt.subplot(224)
 plt.plot(STD, c=colors[0], label='STD (%0.2f-%0.2f)' % (numpy.min(STD),
                                                         numpy.max(STD)))
@@ -65,5 +87,5 @@ plt.axhline(numpy.std(MeanImage), c=colors[1],
 plt.axhline(numpy.mean(STD), c=colors[2],
             label='Mean of STD: %0.2f' % numpy.mean(STD))
 plt.legend(loc='best')
-plt.title('STD of %s images' % len(DarkImages))
+plt.title('STD of %s images' % len(DarkNames))
 plt.show()
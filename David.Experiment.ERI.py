@@ -5,41 +5,96 @@ David.Experiment.ERI.py | David Haberthür <david.haberthuer@psi.ch>
 
 Script file to snap images with different kV and uA settings of the ERI x-ray
 source.
+Start it with '--resume' to continue a run which has been interrupted, with
+the plan saved by the interrupted run. Only the images which are not on disk
+yet are acquired.
 """
 
 # Imports
-from gantry_control import *
 import glob
 import logging
 import random
+import sys
+
+import acquisitionstate
+
+from acquisitionrunner import AcquisitionRunner
+
+# Set to True to run the script without the hardware, with a stand-in for the
+# detector
+simulate = False
+if simulate:
+    from simulatedgantry import *
+else:
+    from gantry_control import *
 
 # Setup
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry')
 
 testing = False
+# Ask for the next voltage while the detector still reads out the last image.
+# We take the image file appearing on disk as the sign that the exposure is
+# over, which we have only checked with the simulated detector so far. Until
+# we have verified this on the real ShadoBox, we only overlap in simulation.
+overlap = simulate
+# We always wait the fixed 5 seconds for the source to settle after a change.
+# A SettleDetector cannot beat this: with the readout of the ShadoBox, the
+# probe images it needs to see a stable source already take longer than 5
+# seconds (see SettleDetector.useful).
 
 # Experimental settings
 Voltages = list(range(25, 65, 1))
-# Randomize voltages to exclude hysteresis
-random.shuffle(Voltages)
 DetectorExposureTime = 30  # Seconds, converted to when setting the detector
 
-# Check if we already have files in the designated directory. If we do,
-# then do not run the script.
-files = glob.glob(os.path.join(StartPath, 'ERI', '*.raw'))
-if files:
-    exit('Remove the %s .raw files in %s before running this script' %
-         (len(files), os.path.join(StartPath, 'ERI')))
-
-# Set up logging
-LogFileName = os.path.join(StartPath, 'ERI', 'ERI.log')
+OutPutPath = os.path.join(StartPath, 'ERI')
+try:
+    os.makedirs(OutPutPath)
+except OSError:
+    pass
+# The plan and the images we completed are saved next to the log file
+PlanFileName = os.path.join(OutPutPath, 'ERI.plan.json')
+CheckpointFileName = os.path.join(OutPutPath, 'ERI.checkpoint')
+
+resume = '--resume' in sys.argv
+if resume:
+    # Continue the interrupted run with its plan, and only acquire the
+    # voltages for which we do not (completely) have an image on disk
+    if not os.path.exists(PlanFileName):
+        exit('There is no plan in %s to resume' % PlanFileName)
+    Voltages, Seed = acquisitionstate.load_plan(PlanFileName)
+    Checkpoint = acquisitionstate.Checkpoint(CheckpointFileName)
+    ToDo = acquisitionstate.reconcile(Voltages, OutPutPath, 'ERI',
+                                      DetectorExposureTime, Checkpoint,
+                                      verbose=True)
+    print 'Resuming the run, %s of the %s planned voltages are still ' \
+          'missing' % (len(ToDo), len(Voltages))
+else:
+    # Check if we already have files in the designated directory. If we do,
+    # then do not run the script.
+    files = glob.glob(os.path.join(OutPutPath, '*.raw'))
+    if files:
+        exit('Remove the %s .raw files in %s before running this script, or '
+             'continue the run with --resume' % (len(files), OutPutPath))
+    # Randomize voltages to exclude hysteresis
+    Seed = random.randint(0, 2 ** 31)
+    random.Random(Seed).shuffle(Voltages)
+    acquisitionstate.save_plan(PlanFileName, 'ERI', DetectorExposureTime,
+                               Voltages, Seed)
+    if os.path.exists(CheckpointFileName):
+        os.remove(CheckpointFileName)
+    Checkpoint = acquisitionstate.Checkpoint(CheckpointFileName)
+    ToDo = range(len(Voltages))
+
+# Set up logging, when resuming we continue the log file
+LogFileName = os.path.join(OutPutPath, 'ERI.log')
 log = logging.getLogger(LogFileName)
 log.setLevel(logging.INFO)
-handler = logging.FileHandler(LogFileName, 'w')
+handler = logging.FileHandler(LogFileName, 'a' if resume else 'w')
 log.addHandler(handler)
 
 # Start Experiment
-log.info('Experiment started at %s', time.strftime('%d.%m.%Y at %H:%M:%S'))
+log.info('Experiment %s at %s', 'resumed' if resume else 'started',
+         time.strftime('%d.%m.%Y at %H:%M:%S'))
 log.info(80 * '-')
 
 # Start the detector
@@ -59,10 +114,15 @@ if not testing:
 log.info('Source voltage will be set from %s kV to %s kV in %s steps.',
          min(Voltages), max(Voltages), len(Voltages))
 log.info('Source current will be entered manually')
+log.info('We acquire %s of %s voltages, shuffled with seed %s.', len(ToDo),
+         len(Voltages), Seed)
 log.info(80 * '-')
 
-for v, voltage in enumerate(Voltages):
-    print 80 * '-'
+
+def set_source(voltage):
+    """
+    Ask the user to set the source to the voltage and to tell us the current
+    """
     current = 0
     while not current:
         try:
@@ -71,30 +131,20 @@ for v, voltage in enumerate(Voltages):
                                     'supply [uA]: ' % voltage))
         except ValueError:
             print('Try inputting an integer number...')
-    print '%s | %s/%s | %s kV/%s uA | %s' % ('ERI', v + 1, len(Voltages),
-                                             voltage, current,
-                                             time.strftime(
-                                                 '%d.%m.%Y at %H:%M:%S'))
-    OutPutPath = os.path.join(StartPath, 'ERI')
-    try:
-        os.makedirs(OutPutPath)
-    except OSError:
-        pass
-    if not testing:
-        sleepytime = 5
-        print 'Waiting for %s seconds until the source has settled...' % \
-              sleepytime
-        time.sleep(sleepytime)
-
-    sb.set_directory(OutPutPath)
-    ImagePrefix = '%s_%03dkV_%03duA_%ssExp' % ('ERI', voltage, current,
-                                               DetectorExposureTime)
-    sb.set_prefix(ImagePrefix)
-    print 'Acquiring image for %s seconds' % DetectorExposureTime
-    sb.acquire(1, 2)
-    log.info('Image %s/%s (%s) acquired at %s', v + 1, len(Voltages),
-             ImagePrefix + '.raw', time.strftime('%d.%m.%Y at %H:%M:%S'))
-    print 'Saved image as %s_01' % ImagePrefix
+    return voltage, current
+
+# Acquire all the voltages, with the timing of each stage in the log
+Runner = AcquisitionRunner(sb, 'ERI', OutPutPath, DetectorExposureTime,
+                           set_source, settletime=0 if testing else 5,
+                           overlap=overlap, log=log, checkpoint=Checkpoint)
+Failed = Runner.run(Voltages, ToDo)
+print 80 * '-'
+print 'Time spent in each stage:'
+Runner.summary()
+if Failed:
+    print 'These %s images have not been written completely:' % len(Failed)
+    print '\n'.join(Failed)
+    print 'Run the script again with --resume to acquire them again'
 
 # Close log file
 log.info(80 * '-')
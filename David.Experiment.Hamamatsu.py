@@ -5,45 +5,136 @@ David.Experiment.Hamamatsu.py | David Haberthür <david.haberthuer@psi.ch>
 
 Script file to snap images with different kV and uA settings of the Hamamatsu
 x-ray source.
+Start it with '--resume' to continue a run which has been interrupted, with
+the plan saved by the interrupted run. Only the images which are not on disk
+yet are acquired.
 """
 
 # Imports
-from gantry_control import *
 import glob
 import logging
 import random
+import sys
+
+import acquisitionplan
+import acquisitionstate
+from acquisitionrunner import AcquisitionRunner
+from settledetector import SettleDetector
+
+# Set to True to run the script without the hardware, with stand-ins for the
+# detector and the tube
+simulate = False
+if simulate:
+    from simulatedgantry import *
+else:
+    from gantry_control import *
 
 # Setup
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry')
 
 testing = False
+# Change the source while the detector still reads out the last image. We
+# take the image file appearing on disk as the sign that the exposure is
+# over, which we have only checked with the simulated detector so far. Until
+# we have verified this on the real ShadoBox, we only overlap in simulation.
+overlap = simulate
+# Look at the source with probe images during the warm-up and go on as soon
+# as it does not drift anymore, instead of always waiting for the full
+# warm-up time (which is then the maximum we wait). Only the warm-up benefits
+# from this. Between the settings we always wait the fixed 5 seconds, since
+# with the readout of the ShadoBox, the probe images needed to see a stable
+# source already take longer than that (see SettleDetector.useful).
+adaptivesettle = True
 
 # Experimental settings
 Voltages = range(25, 65, 1)
 Currents = range(10, 201, 5)
-# Randomize voltages and currents to exclude hysteresis
-random.shuffle(Voltages)
-random.shuffle(Currents)
 DetectorExposureTime = 15  # Seconds, converted to ms when setting the detector
-
-# Check if we already have files in the designated directory. If we do,
-# then do not run the script.
-files = glob.glob(os.path.join(StartPath, 'Hamamatsu', '*.raw'))
-if files:
-    exit('Remove the %s .raw files in %s before running this script' %
-         (len(files), os.path.join(StartPath, 'Hamamatsu')))
-
-# Set up logging
-LogFileName = os.path.join(StartPath, 'Hamamatsu', 'Hamamatsu.log')
+WarmUpTime = 5 * 60 * 60  # Seconds
+
+OutPutPath = os.path.join(StartPath, 'Hamamatsu')
+try:
+    os.makedirs(OutPutPath)
+except OSError:
+    pass
+# The plan and the images we completed are saved next to the log file
+PlanFileName = os.path.join(OutPutPath, 'Hamamatsu.plan.json')
+CheckpointFileName = os.path.join(OutPutPath, 'Hamamatsu.checkpoint')
+
+resume = '--resume' in sys.argv
+if resume:
+    # Continue the interrupted run with its plan, and only acquire the
+    # images which we do not (completely) have on disk
+    if not os.path.exists(PlanFileName):
+        exit('There is no plan in %s to resume' % PlanFileName)
+    Settings, Seed = acquisitionstate.load_plan(PlanFileName)
+    Dropped = []
+    Checkpoint = acquisitionstate.Checkpoint(CheckpointFileName)
+    ToDo = acquisitionstate.reconcile(Settings, OutPutPath, 'Hamamatsu',
+                                      DetectorExposureTime, Checkpoint,
+                                      verbose=True)
+    print 'Resuming the run, %s of the %s planned settings are still ' \
+          'missing' % (len(ToDo), len(Settings))
+else:
+    # Check if we already have files in the designated directory. If we do,
+    # then do not run the script.
+    files = glob.glob(os.path.join(OutPutPath, '*.raw'))
+    if files:
+        exit('Remove the %s .raw files in %s before running this script, or '
+             'continue the run with --resume' % (len(files), OutPutPath))
+    # Plan all the settings we acquire. Settings the source cannot do
+    # according to its data sheet are dropped. To exclude hysteresis, we go
+    # through blocks of five voltages in random order, but inside the blocks
+    # we change the voltage and current only in small steps, so the source
+    # settles quickly.
+    Seed = random.randint(0, 2 ** 31)
+    Settings, Dropped = acquisitionplan.plan(Voltages, Currents, blocksize=5,
+                                             seed=Seed)
+    acquisitionstate.save_plan(PlanFileName, 'Hamamatsu',
+                               DetectorExposureTime, Settings, Seed)
+    if os.path.exists(CheckpointFileName):
+        os.remove(CheckpointFileName)
+    Checkpoint = acquisitionstate.Checkpoint(CheckpointFileName)
+    ToDo = range(len(Settings))
+    # For comparison: the old plan, which shuffled the voltages and the
+    # currents independently and thus ramped the source much more often
+    Shuffled = [(v, c) for v in random.sample(Voltages, len(Voltages)) for c
+                in random.sample(Currents, len(Currents)) if
+                acquisitionplan.feasible(v, c)]
+    print 'We acquire %s settings and drop %s which are outside of the ' \
+          'data sheet of the source' % (len(Settings), len(Dropped))
+    print 'Shuffling voltage and current independently would take %0.1f ' \
+          'hours' % (acquisitionplan.predicted_time(
+              Shuffled, DetectorExposureTime, overlap=overlap) / 3600.)
+PredictedTime = acquisitionplan.predicted_time(
+    [Settings[i] for i in ToDo], DetectorExposureTime, overlap=overlap)
+print 'The acquisition will take about %0.1f hours (plus at most %s hours ' \
+      'warm-up)' % (PredictedTime / 3600., WarmUpTime / 3600)
+print 'If we start now, we are done on %s' % time.strftime(
+    '%d.%m.%Y at %H:%M:%S', time.localtime(time.time() + WarmUpTime +
+                                           PredictedTime))
+
+# Set up logging, when resuming we continue the log file
+LogFileName = os.path.join(OutPutPath, 'Hamamatsu.log')
 log = logging.getLogger(LogFileName)
 log.setLevel(logging.INFO)
-handler = logging.FileHandler(LogFileName, 'w')
+handler = logging.FileHandler(LogFileName, 'a' if resume else 'w')
 log.addHandler(handler)
 
 # Start Experiment
-log.info('Experiment started at %s', time.strftime('%d.%m.%Y at %H:%M:%S'))
+log.info('Experiment %s at %s', 'resumed' if resume else 'started',
+         time.strftime('%d.%m.%Y at %H:%M:%S'))
 log.info(80 * '-')
 
+# Start the detector
+print 'Starting the ShadoBox detector'
+# Check if we have the camera here
+if not sb.is_camera_on():
+    sb.start()
+# Set exposure time (sb.set_exposure_time() expects ms)
+print 'Setting exposure time to %s' % DetectorExposureTime
+sb.set_exposure_time(DetectorExposureTime * 1000)
+
 if not testing:
     print 'Starting the Hamamatsu tube'
     # Start the source with some moderate settings and let it run for five
@@ -55,69 +146,59 @@ if not testing:
     tube.set_current(50)
     log.info('Started Hamamatsu source at %s',
              time.strftime('%d.%m.%Y at %H:%M:%S'))
-    print 'Waiting for 5 hours until source stabilized'
-    finishtime = time.time() + 5 * 60 * 60
-    print 'Will continue on %s' % time.strftime('%d.%m.%Y at %H:%M:%S',
-                                                time.gmtime(finishtime))
-    time.sleep(5 * 60 * 60)
+    print 'Waiting for at most %s hours until source stabilized' % (
+        WarmUpTime / 3600)
+    finishtime = time.time() + WarmUpTime
+    print 'Will continue on %s at the latest' % time.strftime(
+        '%d.%m.%Y at %H:%M:%S', time.gmtime(finishtime))
+    if adaptivesettle:
+        # One probe image per minute, the source is stable once the
+        # brightness changed less than 0.1% over ten minutes
+        SettleDetector(sb, OutPutPath, DetectorExposureTime, probeexposure=1,
+                       tolerance=0.001, stable=10, interval=60,
+                       ceiling=WarmUpTime, log=log).wait()
+    else:
+        time.sleep(WarmUpTime)
     log.info('Source stabilization completed at %s',
              time.strftime('%d.%m.%Y at %H:%M:%S'))
 
-# Start the detector
-print 'Starting the ShadoBox detector'
-# Check if we have the camera here
-if not sb.is_camera_on():
-    sb.start()
-# Set exposure time (sb.set_exposure_time() expects ms)
-print 'Setting exposure time to %s' % DetectorExposureTime
-sb.set_exposure_time(DetectorExposureTime * 1000)
-
 # Log experiment conditions
 log.info('Source voltage will be set from %s kV to %s kV in %s steps.',
          min(Voltages), max(Voltages), len(Voltages))
 log.info('Source current will be set from %s uA to %s uA in %s steps.',
          min(Currents), max(Currents), len(Currents))
+log.info('We acquire %s of %s settings, planned with seed %s, and predicted to '
+         'take %0.1f hours.', len(ToDo), len(Settings), Seed,
+         PredictedTime / 3600.)
+for voltage, current in Dropped:
+    log.info('Dropped %s kV and %s uA, which is outside of the data sheet of '
+             'the source.', voltage, current)
 log.info(80 * '-')
 
-for v, voltage in enumerate(Voltages):
-    for c, current in enumerate(Currents):
-        print 80 * '-'
-        print '%s | %s/%s | %s kV/%s uA' % ('Hamamatsu', (v + 1) * (c + 1),
-                                            len(Voltages) * len(Currents),
-                                            voltage, current)
-        # Only use the settings that the Hamamatsu source is able to do
-        # so according to its data sheet
-        if voltage < 40 and current > 100:
-            print 'According to the data sheet of the Hamamtsu source, ' \
-                  'we cannot operate it safely at %s kV and %s uA' % (voltage,
-                                                                      current)
-            print 'Skipping this setting...'
-        else:
-            OutPutPath = os.path.join(StartPath, 'Hamamatsu')
-            try:
-                os.makedirs(OutPutPath)
-            except OSError:
-                pass
-            if not testing:
-                sleepytime = 5
-                print 'Setting tube to %s kV and %s uA and waiting for %s ' \
-                      'seconds until it has settled...' % (voltage, current,
-                                                           sleepytime)
-                tube.set_voltage(voltage)
-                tube.set_current(current)
-                time.sleep(sleepytime)
-
-            sb.set_directory(OutPutPath)
-            ImagePrefix = '%s_%03dkV_%03duA_%ssExp' % ('Hamamatsu', voltage,
-                                                       current,
-                                                       DetectorExposureTime)
-            sb.set_prefix(ImagePrefix)
-            print 'Acquiring image for %s seconds' % DetectorExposureTime
-            sb.acquire(1, 2)
-            log.info('Image %s/%s (%s) acquired at %s', (v + 1) * (c + 1),
-                     len(Voltages) * len(Currents), ImagePrefix + '.raw',
-                     time.strftime('%d.%m.%Y at %H:%M:%S'))
-            print 'Saved image as %s_01' % ImagePrefix
+
+def set_tube(setting):
+    """
+    Set the tube to one (kV, uA) setting of the plan
+    """
+    voltage, current = setting
+    if not testing:
+        print 'Setting tube to %s kV and %s uA' % (voltage, current)
+        tube.set_voltage(voltage)
+        tube.set_current(current)
+    return voltage, current
+
+# Acquire all the settings, with the timing of each stage in the log
+Runner = AcquisitionRunner(sb, 'Hamamatsu', OutPutPath, DetectorExposureTime,
+                           set_tube, settletime=0 if testing else 5,
+                           overlap=overlap, log=log, checkpoint=Checkpoint)
+Failed = Runner.run(Settings, ToDo)
+print 80 * '-'
+print 'Time spent in each stage:'
+Runner.summary()
+if Failed:
+    print 'These %s images have not been written completely:' % len(Failed)
+    print '\n'.join(Failed)
+    print 'Run the script again with --resume to acquire them again'
 
 # Close log file
 log.info(80 * '-')
@@ -3,6 +3,9 @@ Functions that we use over and over for analyzing the ERI data.
 And some consistent settings for display.
 """
 
+import contextlib
+import os
+import re
 import numpy
 import matplotlib.pylab as plt
 
@@ -14,23 +17,185 @@ plt.rc('lines', linewidth=2)
 plt.rc('axes', grid=True)
 
 
-def read_raw(filename, width=2048, height=1024, verbose=False):
+def read_raw(filename, width=2048, height=1024, verbose=False, memmap=False,
+             defects=None):
     """
-    Read the .raw file from the ShadoBox into a numpy array, ready to display
+    Read the .raw file from the ShadoBox into a numpy array, ready to display.
+    With memmap=True we do not read anything, but map the file into memory
+    and return a (read-only) big-endian view of it. Pixels are then only read
+    from disk when they are touched, so cropping a region of the image only
+    costs the bytes inside the crop.
+    If we get 'defects' (from defectpixels.defect_replacement), we replace
+    the defective pixels with the median of their neighbours. Since this
+    changes the image, we do not return a memory map in this case.
     """
     if verbose:
         print 'Reading image %s' % filename
-    # Reading RAW image from the ShadoBox detector. The image is saved as 16
-    # bit, with the camera width and height. We swap the endianness of the
-    # image to display it nicely.
-    image = numpy.fromfile(filename, dtype=numpy.uint16, count=-1).reshape(
-        height, width).byteswap()
-    # Flip image upside down and left-right, so we can look at it without
-    # craning our neck.
-    image = numpy.flipud(image)
+    if memmap:
+        # Map the file as big-endian 16 bit, so that we do not need to swap
+        # the bytes ourselves. Flipping upside down with a negative stride is
+        # only a view on the map, no pixel is copied.
+        image = numpy.memmap(filename, dtype='>u2', mode='r',
+                             shape=(height, width))[::-1]
+        if defects is None:
+            return image
+        image = image.astype(numpy.uint16)
+    else:
+        # Reading RAW image from the ShadoBox detector. The image is saved as
+        # 16 bit, with the camera width and height. We swap the endianness of
+        # the image to display it nicely.
+        image = numpy.fromfile(filename, dtype=numpy.uint16,
+                               count=-1).reshape(height, width).byteswap()
+        # Flip image upside down and left-right, so we can look at it without
+        # craning our neck.
+        image = numpy.flipud(image)
+    if defects is not None:
+        # Replace defective pixels with the median of their neighbours
+        defectpixels, neighbours = defects
+        image[defectpixels] = numpy.median(image[neighbours], axis=1)
     return image
 
 
+def read_raw_stack(filenames, roi=None, width=2048, height=1024, threads=8,
+                   verbose=False):
+    """
+    Read a list of .raw files from the ShadoBox into *one* preallocated
+    (N, height, width) uint16 array, oriented like the images from read_raw.
+    If the user supplies a region of interest in the form of roi =
+    [top, bottom, left, right] (the same way as the 'CropRegion' in the
+    resolution scripts), we only keep (and only read) this region.
+    The files are read with 'readinto' directly into the stack from a pool of
+    threads, so that the reads from the network mount overlap.
+    """
+    from multiprocessing.pool import ThreadPool
+    if roi is None:
+        roi = [0, height, 0, width]
+    top, bottom, left, right = roi
+    if verbose:
+        print 'Reading %s images into a %sx%sx%s stack' % (
+            len(filenames), len(filenames), bottom - top, right - left)
+    stack = numpy.empty((len(filenames), bottom - top, right - left),
+                        dtype=numpy.uint16)
+
+    def read_into_stack(counter):
+        if left == 0 and right == width:
+            # Read the rows we need straight into the stack. The image is
+            # stored upside down, so the rows at the top of the displayed
+            # image are at the end of the file
+            with open(filenames[counter], 'rb') as rawfile:
+                rawfile.seek((height - bottom) * width * 2)
+                read = rawfile.readinto(memoryview(stack[counter]))
+            # Truncated (or still growing) files would leave garbage in the
+            # stack
+            if read < (bottom - top) * width * 2:
+                raise IOError('%s is too short, we only read %s of %s bytes'
+                              % (filenames[counter], read,
+                                 (bottom - top) * width * 2))
+            # Swap endianness and flip upside down, both in place
+            stack[counter].byteswap(True)
+            stack[counter] = stack[counter][::-1]
+        else:
+            # Only copy the columns we need from a memory mapped image
+            stack[counter] = read_raw(filenames[counter], width=width,
+                                      height=height,
+                                      memmap=True)[top:bottom, left:right]
+
+    pool = ThreadPool(threads)
+    try:
+        pool.map(read_into_stack, range(len(filenames)))
+    finally:
+        pool.close()
+        pool.join()
+    return stack
+
+
+def parse_settings(filename):
+    """
+    Get the source, voltage [kV], current [uA] and detector exposure time [s]
+    from the file name of an image, which the acquisition scripts save as
+    'Source_VVVkV_CCCuA_EEsExp_01.raw'.
+    """
+    parts = os.path.basename(filename).split('_')
+    return parts[0], int(parts[1][:-2]), int(parts[2][:-2]), \
+        int(parts[3][:-4])
+
+
+def parse_exposure(filename):
+    """
+    Get the detector exposure time [s] from the '_NNsExp' part of the file
+    name of an image. Returns None if the file name does not contain it.
+    """
+    match = re.search(r'_(\d+)sExp', os.path.basename(filename))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def match_settings(voltage, current, referencevoltage, referencecurrent,
+                   k=1):
+    """
+    Find the best matching settings from a reference set of images (e.g. from
+    Hamamatsu) for each (voltage, current) setting of another set (e.g.
+    from ERI). We only look at reference images with the *same* voltage and
+    from those take the ones with the closest current.
+    The function returns two (N, k) arrays, with the indices of the k nearest
+    reference settings (closest first) and their current difference. If
+    there are less than k candidates with the same voltage, the remaining
+    indices are -1 and the distances are infinite.
+    """
+    voltage = numpy.asarray(voltage, dtype=numpy.int64)
+    current = numpy.asarray(current, dtype=numpy.int64)
+    referencevoltage = numpy.asarray(referencevoltage, dtype=numpy.int64)
+    referencecurrent = numpy.asarray(referencecurrent, dtype=numpy.int64)
+    # Sort the reference by voltage and then current, so that each voltage is
+    # one block of sorted currents. We look up all settings at once with one
+    # 'searchsorted' on a combined key.
+    order = numpy.lexsort((referencecurrent, referencevoltage))
+    sortedvoltage = referencevoltage[order]
+    sortedcurrent = referencecurrent[order]
+    offset = max(referencecurrent.max(), current.max()) + 1
+    position = numpy.searchsorted(sortedvoltage * offset + sortedcurrent,
+                                  voltage * offset + current)
+    blockstart = numpy.searchsorted(sortedvoltage, voltage, side='left')
+    blockend = numpy.searchsorted(sortedvoltage, voltage, side='right')
+    # The k nearest candidates are within k positions of the insertion point
+    candidates = position[:, numpy.newaxis] + numpy.arange(-k, k)
+    valid = (candidates >= blockstart[:, numpy.newaxis]) & \
+            (candidates < blockend[:, numpy.newaxis])
+    candidates = numpy.clip(candidates, 0, len(order) - 1)
+    distances = numpy.where(valid, numpy.abs(
+        sortedcurrent[candidates] - current[:, numpy.newaxis]), numpy.inf)
+    # Stable sort, so that for equal distances the lower current wins
+    nearest = numpy.argsort(distances, axis=1, kind='mergesort')[:, :k]
+    rows = numpy.arange(len(voltage))[:, numpy.newaxis]
+    distances = distances[rows, nearest]
+    matches = numpy.where(numpy.isfinite(distances),
+                          order[candidates[rows, nearest]], -1)
+    return matches, distances
+
+
+def best_matches(voltage, current, referencevoltage, referencecurrent,
+                 filenames=None):
+    """
+    The best matching reference setting for each (voltage, current) setting,
+    like match_settings. Settings without a reference image at the same
+    voltage are reported (with their 'filenames', if we get them) and
+    skipped. Returns the indices of the settings we found a match for and the
+    indices of their matches in the reference.
+    """
+    matches, distances = match_settings(voltage, current, referencevoltage,
+                                        referencecurrent)
+    found = matches[:, 0] >= 0
+    for missing in numpy.flatnonzero(~found):
+        print 'No reference image with %s kV for %s, we skip it' % (
+            voltage[missing], filenames[missing] if filenames else
+            '%s uA' % current[missing])
+    if not numpy.any(found):
+        raise ValueError('None of the settings has a reference image with '
+                         'the same voltage')
+    return numpy.flatnonzero(found), matches[found, 0]
+
+
 def contrast_stretch(image, std=3, verbose=False):
     """
     Clip image histogram to the mean \pm N standard deviations, according to
@@ -39,14 +204,98 @@ def contrast_stretch(image, std=3, verbose=False):
     if verbose:
         print 'Clipping image from [' + str(numpy.min(image)) + ':' + \
               str(numpy.max(image)) + '] to',
-    clippedimage = numpy.clip(image, numpy.mean(image) - (std * numpy.std(
-        image)), numpy.mean(image) + (std * numpy.std(image)))
+    if numpy.issubdtype(image.dtype, numpy.integer):
+        # Get mean and STD of the detector images from their histogram
+        from imagestatistics import ImageStats
+        stats = ImageStats(image)
+        mean, stdev = stats.mean, stats.std()
+    else:
+        mean, stdev = numpy.mean(image), numpy.std(image)
+    clippedimage = numpy.clip(image, mean - std * stdev, mean + std * stdev)
     if verbose:
         print '[' + str(numpy.min(clippedimage)) + ':' + str(numpy.max(
             clippedimage)) + ']'
     return clippedimage
 
 
+def display_lut(low, high):
+    """
+    Look-up table which maps all 16 bit gray values to 8 bit, stretching the
+    window [low, high] to [0, 255] and clipping everything outside it.
+    """
+    lut = (numpy.arange(2 ** 16) - low) * (255. / max(high - low, 1e-6))
+    return numpy.clip(numpy.round(lut), 0, 255).astype(numpy.uint8)
+
+
+def display_image(image, window='sigma', std=3, percentiles=(0.5, 99.5),
+                  limits=None):
+    """
+    Map an image to 8 bit for display, so that matplotlib does not need to
+    normalize the full image again for each imshow (show it with
+    plt.imshow(display_image(image), vmin=0, vmax=255)).
+    The window which is stretched to [0, 255] is either
+    - 'sigma': mean \pm 'std' standard deviations, like contrast_stretch
+    - 'percentile': between the two 'percentiles' of the gray values or
+    - 'fixed': the given 'limits' = [low, high].
+    For detector images we calculate the window once from the histogram and
+    then map the image with one look-up in a 16 bit look-up table.
+    """
+    integer = numpy.issubdtype(image.dtype, numpy.integer)
+    if window == 'fixed':
+        low, high = limits
+    elif window in ('sigma', 'percentile'):
+        if integer:
+            from imagestatistics import ImageStats
+            stats = ImageStats(image)
+            if window == 'sigma':
+                low = stats.mean - std * stats.std()
+                high = stats.mean + std * stats.std()
+            else:
+                low, high = stats.percentile(percentiles)
+        elif window == 'sigma':
+            low = numpy.mean(image) - std * numpy.std(image)
+            high = numpy.mean(image) + std * numpy.std(image)
+        else:
+            low, high = numpy.percentile(image, percentiles)
+    else:
+        raise ValueError('Unknown display window "%s"' % window)
+    if integer:
+        return numpy.take(display_lut(low, high), image)
+    # Images which are not integer (e.g. averages) cannot be looked up
+    scaled = (image - low) * (255. / max(high - low, 1e-6))
+    return numpy.clip(numpy.round(scaled), 0, 255).astype(numpy.uint8)
+
+
+def make_directory(directory):
+    """
+    Create 'directory' (and its parents), if it does not exist yet
+    """
+    try:
+        os.makedirs(directory)
+    except OSError:
+        # Directory already exists
+        if not os.path.isdir(directory):
+            raise
+
+
+@contextlib.contextmanager
+def atomic_write(filename, mode='wb'):
+    """
+    Open a temporary file next to 'filename' for writing, and only rename it
+    to 'filename' once everything has been written. Like this we never leave
+    a broken file behind, e.g. if a script is stopped while writing.
+    """
+    temporary = filename + '.tmp'
+    try:
+        with open(temporary, mode) as outfile:
+            yield outfile
+    except:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.rename(temporary, filename)
+
+
 def ask_user(Blurb, Choices):
     """
     Ask for user input.
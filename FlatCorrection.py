@@ -5,15 +5,19 @@ FlatCorrection.py | David Haberthuer
 Script to correct the images with the flats.
 """
 
-import numpy
 import os
 import glob
 import matplotlib.pylab as plt
 
 from ERIfunctions import *
+from masterframes import cached_master_frame, DarkLibrary
+from flatfield import correct_projections, eigenflats
+from projectionstack import ProjectionStack
 
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry', 'Images')
-ImageFolders = sorted(glob.glob(os.path.join(StartPath, '*')))
+# Only the image folders, not the catalog or metrics store next to them
+ImageFolders = sorted(f for f in glob.glob(os.path.join(StartPath, '*'))
+                      if os.path.isdir(f))
 for c, folder in enumerate(ImageFolders):
     print 'Folder %s (%s) contains %s files' % (c, os.path.basename(folder),
                                                 len(glob.glob(os.path.join(
@@ -21,48 +25,79 @@ for c, folder in enumerate(ImageFolders):
 
 print 80 * '-'
 
+# The darks are only used for the master dark
+ImageFolders = [f for f in ImageFolders if os.path.basename(f) != 'Darks']
 FlatFolder = ask_user('From which folder should we load the flats?',
-                      ImageFolders[1:])
+                      ImageFolders)
 ProjectionFolder = ask_user('From which folder should we load the images '
-                            'from?', ImageFolders[1:])
+                            'from?', ImageFolders)
 
 LoadEvery = 1
-# Load dark images
-print 'Loading every %sth dark image' % LoadEvery
-DarkNames = sorted(glob.glob(os.path.join(StartPath, 'Darks',
-                                          '*.raw')))[::LoadEvery]
-print '\tReading in %s images in %s' % (len(DarkNames),
-                                        os.path.join(StartPath, 'Darks'))
-DarkImages = [read_raw(i) for i in DarkNames]
-print 'Calculating average of %s dark images' % len(DarkImages)
-AverageDark = numpy.average(DarkImages, axis=0)
+# Set to False to only correct the projections, without plotting each one
+ShowPlots = True
+# How to calculate the master dark and flat from the single images: 'median',
+# 'sigmaclip' (mean without outliers) or plain 'mean'
+MasterMethod = 'sigmaclip'
+# Dynamic flat-field correction: fit a flat to each projection from the
+# principal components of all flats, to correct for the drift of the source.
+# The flats are fitted in 'FitRegion' ([top, bottom, left, right]), which
+# must not contain any sample, so we need it for the dynamic correction.
+DynamicFlats = False
+EigenFlats = 10
+FitRegion = None
+if DynamicFlats and FitRegion is None:
+    exit('Set "FitRegion" to a region without sample for the dynamic '
+         'flat-field correction')
+ProjectionImages = sorted(glob.glob(os.path.join(ProjectionFolder, '*.raw')))
+# Get the dark for the exposure time of the projections from the library of
+# all darks, which interpolates if we do not have darks with this exposure time
+ExposureTime = parse_exposure(ProjectionImages[0])
+Darks = DarkLibrary(os.path.join(StartPath, 'Darks'), method=MasterMethod,
+                    verbose=True)
+print 'Getting dark for %s s exposure time from the darks in %s' % (
+    ExposureTime, Darks.darkfolder)
+AverageDark = Darks.dark(ExposureTime)
 
 # Loading flat images
 print 'Loading every %sth flat image' % LoadEvery
 FlatNames = sorted(glob.glob(os.path.join(FlatFolder, '*.raw')))[::LoadEvery]
 print '\tReading in %s images in %s' % (len(FlatNames), FlatFolder)
-FlatImages = [read_raw(i) for i in FlatNames]
 # Calculating values
-print 'Calculating average of %s flat images' % len(FlatImages)
-AverageFlat = numpy.average(FlatImages, axis=0)
+print 'Calculating average of %s flat images' % len(FlatNames)
+AverageFlat = cached_master_frame(FlatNames, method=MasterMethod, verbose=True)
+if DynamicFlats:
+    print 'Calculating %s eigen flats of %s flat images' % (EigenFlats,
+                                                           len(FlatNames))
+    MeanFlat, EigenFlatImages = eigenflats(FlatNames, components=EigenFlats,
+                                           verbose=True)
+    # The eigen flats describe the deviations from the mean flat, so we
+    # correct with it and not with the (outlier-free) average flat
+    CorrectionFlat = MeanFlat
+else:
+    EigenFlatImages = None
+    CorrectionFlat = AverageFlat
+
+# Correcting all projections
+print 'Correcting %s projections in %s' % (len(ProjectionImages),
+                                           ProjectionFolder)
+CorrectedImages = correct_projections(
+    ProjectionImages, AverageDark, CorrectionFlat,
+    ProjectionStack(os.path.join(ProjectionFolder, 'Corrected'),
+                    overwrite=True), eigenflats=EigenFlatImages,
+    fitregion=FitRegion, verbose=True)
+print 'Saved corrected projections to %s' % CorrectedImages.directory
+
+if not ShowPlots:
+    exit('Done')
 
 plt.ion()
 plt.figure(figsize=[16, 10])
-
-# Loading projections and correcting each one
-ProjectionImages = sorted(glob.glob(os.path.join(ProjectionFolder, '*.raw')))
 for c, p in enumerate(ProjectionImages):
-    print '%s/%s: Reading projection %s' % (c + 1, len(ProjectionImages),
-                                            os.path.basename(p))
-    ProjectionImage = read_raw(p)
-    Voltage = int(p.split('_')[1][:-2])
-    Current = int(p.split('_')[2][:-2])
-    ExposureTime = int(p.split('_')[3][:-4])
-
-    # P=-ln((P-D)/(F-D)), while D and F are mean darks and mean flats
-    CorrectedImage = numpy.negative(numpy.log(numpy.divide(
-        numpy.subtract(ProjectionImage, AverageDark),
-        numpy.subtract(AverageFlat, AverageDark))))
+    print '%s/%s: Plotting projection %s' % (c + 1, len(ProjectionImages),
+                                             os.path.basename(p))
+    ProjectionImage = read_raw(p, memmap=True)
+    CorrectedImage = CorrectedImages[c]
+    Source, Voltage, Current, ExposureTime = parse_settings(p)
 
     plt.clf()
     plt.subplot(231)
@@ -78,10 +113,9 @@ for c, p in enumerate(ProjectionImages):
     plt.imshow(CorrectedImage)
     plt.title('Corrected image')
     plt.suptitle('%s\nImage acquired at %skV and %suA\nwith a Detector '
-                 'exposure time of %ss' % (os.path.basename(p.split('_')[0]),
+                 'exposure time of %ss' % (Source,
                                            Voltage, Current, ExposureTime))
     plt.savefig(os.path.splitext(p)[0] + '.figure.png')
-    plt.imsave(os.path.splitext(p)[0] + '.corrected.png', CorrectedImage)
     plt.draw()
 
 print 'Done'
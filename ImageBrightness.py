@@ -16,6 +16,7 @@ import glob
 import matplotlib.pylab as plt
 
 from ERIfunctions import *
+from imagestatistics import image_statistics
 
 # Colors from 'I want hue'
 colors = ["#84DEBD", "#D1B9D4", "#D1D171"]
@@ -36,17 +37,14 @@ ImageNames = sorted(glob.glob(os.path.join(StartPath, SelectedFolder,
                                            '*.raw')))
 if not ImageNames:
     exit('No images found, is "%s" the correct directory?' % StartPath)
-print 'Reading in %s images in %s' % (len(ImageNames),
-                                      os.path.basename(SelectedFolder))
-Images = [read_raw(i) for i in ImageNames]
-
-# Calculating values
-print 'Calculating average image'
-MeanImage = numpy.mean(Images, axis=0)
-print 'Extracting mean (brightness) of %s raw images' % len(ImageNames)
-Brightness = [numpy.mean(i) for i in Images]
-print 'Extracting gray value STD of %s raw images' % len(ImageNames)
-STD = [numpy.std(i) for i in Images]
+# Calculating values while reading the images in chunks
+print 'Reading in %s images in %s and calculating average image, mean ' \
+      '(brightness) and gray value STD' % (len(ImageNames),
+                                           os.path.basename(SelectedFolder))
+Statistics = image_statistics(ImageNames, verbose=True)
+MeanImage = Statistics.mean
+Brightness = Statistics.framemean
+STD = Statistics.framestd
 
 plt.figure(figsize=[16, 9])
 plt.subplot(221)
@@ -55,7 +53,7 @@ plt.title('Average image with a min of %s and a max of'
           ' %s' % (numpy.min(MeanImage), numpy.max(MeanImage)))
 plt.subplot(222)
 std = 3
-plt.imshow(contrast_stretch(MeanImage, std=std))
+plt.imshow(display_image(MeanImage, std=std), vmin=0, vmax=255)
 plt.title('Contrast stretched average image (mean +- %s STD)' % std)
 plt.subplot(223)
 plt.plot(Brightness, c=colors[0], label='Image mean (%0.2f-%0.2f)' % (
@@ -65,7 +63,7 @@ plt.axhline(numpy.mean(MeanImage), c=colors[1], alpha=0.5,
 plt.axhline(numpy.mean(Brightness), c=colors[2], alpha=0.5,
             label='Mean of Brightness: %0.2f' % numpy.mean(Brightness))
 plt.legend(loc='best')
-plt.title('Brightness of %s images' % len(Images))
+plt.title('Brightness of %s images' % len(ImageNames))
 plt.subplot(224)
 plt.plot(STD, c=colors[0], label='STD (%0.2f-%0.2f)' % (numpy.min(STD),
                                                         numpy.max(STD)))
@@ -74,7 +72,7 @@ plt.axhline(numpy.std(MeanImage), c=colors[1],
 plt.axhline(numpy.mean(STD), c=colors[2],
             label='Mean of STD: %0.2f' % numpy.mean(STD))
 plt.legend(loc='best')
-plt.title('STD of %s images' % len(Images))
+plt.title('STD of %s images' % len(ImageNames))
 
 if 'anomalocaris' in platform.node() or 'vpn' in platform.node():
     print 'Running on OSX, setting different start path'
@@ -8,26 +8,26 @@ And it also plots the combinations we acquired for the Hamamatsu source
 """
 
 import os
-import glob
 import matplotlib.pylab as plt
 
+import imagecatalog
+
 # Wider default curves, better markers and grid
 plt.rc('lines', linewidth=2, marker='o')
 plt.rc('axes', grid=True)
 
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry', 'Images')
-# Get all folders in StartPath and ask user which one we should plot
-Folders = glob.glob(os.path.join(StartPath, '*'))
+# Get all folders in StartPath from the catalog and plot each one
+Catalog = imagecatalog.scan(StartPath)
+Folders = imagecatalog.folders(Catalog)
 for counter, FolderToPlot in enumerate(Folders):
-    ImageList = glob.glob(os.path.join(FolderToPlot, '*.raw'))
+    FolderCatalog = imagecatalog.select(Catalog, folder=FolderToPlot)
 
     print '%s/%s: Reading values from %s images in folder ' \
-          '%s' % (counter + 1, len(Folders), len(ImageList),
+          '%s' % (counter + 1, len(Folders), len(FolderCatalog),
                   os.path.basename(FolderToPlot))
-    Voltage = [int(os.path.basename(image).split('_')[1][:-2]) for image in
-               ImageList]
-    Current = [int(os.path.basename(image).split('_')[2][:-2]) for image in
-               ImageList]
+    Voltage = FolderCatalog['voltage']
+    Current = FolderCatalog['current']
     plt.scatter(Voltage, Current, label=os.path.basename(FolderToPlot))
     plt.xlabel('Voltage [kV]')
     plt.ylabel('Current [uA]')
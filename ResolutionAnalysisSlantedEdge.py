@@ -8,7 +8,6 @@ Script to plot a line through some of the regions of the resolution phantom.
 
 # Imports
 import os
-import glob
 import platform
 import matplotlib
 # Make sure we are running a good version of matplotlib (i.e. > 1)
@@ -24,36 +23,9 @@ import matplotlib.pylab as plt
 from matplotlib.patches import Rectangle
 
 from ERIfunctions import *
-
-
-#  Functions
-def gaussianfit(data):
-    from scipy.optimize import curve_fit
-
-    # Define gaussian model function which we use to calculate a fit to the data
-    def gauss(x, *p):
-        A, mu, sigma = p
-        return A * numpy.exp(-(x - mu) ** 2 / (2. * sigma ** 2))
-    # Fit with initial guess p0
-    p0 = [50, len(data) / 2, 0.2]
-    try:
-        # Try to fit a curve, if we fail, then return only zeros
-        coeff, var_matrix = curve_fit(gauss, range(0, len(data)), data, p0=p0)
-        return gauss(range(0, len(data)), *coeff)
-    except RuntimeError:
-        return numpy.zeros(len(data))
-
-
-def LSF(edgespreadfunction):
-    return numpy.abs(numpy.diff(edgespreadfunction))
-
-
-def MTF(linespreadfunction):
-    return numpy.abs(numpy.fft.fft(linespreadfunction))[:len(linespreadfunction) / 2]
-
-
-def normalize(data):
-    return (data - numpy.min(data)) / (numpy.max(data) - numpy.min(data))
+import imagecatalog
+from previewcache import show_preview
+import mtfengine
 
 # Display all images consistently
 plt.rc('image', cmap='gray', interpolation='nearest')
@@ -66,9 +38,10 @@ Colors = ["#E9AE70", "#7DDCD8", "#E7B0CF", "#9DE380", "#6CE3AF", "#ABC7E5", "#D8
 
 # Choose the folders we want to compare with each other
 StartPath = '/sls/X02DA/data/e13960/Data20/Gantry/Images'
+# Read (and update) the catalog of all images
+Catalog = imagecatalog.scan(StartPath)
 # Filter list for only 'Grid' folders: http://stackoverflow.com/a/4260304
-FolderList = [i if 'Grid' in i else '' for i in
-              sorted(os.walk(StartPath).next()[1])]
+FolderList = [i if 'Grid' in i else '' for i in imagecatalog.folders(Catalog)]
 # Filter list to ERI/Hamamatsu
 ERIFolders = [i if 'ERI' in i else '' for i in FolderList]
 HamamatsuFolders = [i if 'Hamamatsu' in i else '' for i in FolderList]
@@ -85,50 +58,54 @@ OutputPath = os.path.join(os.path.expanduser('~'), 'Data20', 'CNT',
                           'Edge-Comparison-' +
                           os.path.basename(ChosenERI) + '_VS_' +
                           os.path.basename(ChosenHamamatsu))
-try:
-    os.makedirs(OutputPath)
-except OSError:
-    # Directory already exists
-    pass
+make_directory(OutputPath)
 
 # Grab necessary values from the images in the two chosen folders
-ImageListERI = sorted(glob.glob(os.path.join(StartPath, ChosenERI, '*.raw')))
+CatalogERI = imagecatalog.select(Catalog, folder=ChosenERI)
+ImageListERI = imagecatalog.filenames(CatalogERI, StartPath)
 print 'Reading Parameters from %s images in %s' % (len(ImageListERI),
                                                    bold(ChosenERI))
-VoltageERI = [int(os.path.basename(i).split('_')[1][:-2]) for i in ImageListERI]
-CurrentERI = [int(os.path.basename(i).split('_')[2][:-2]) for i in ImageListERI]
+VoltageERI = list(CatalogERI['voltage'])
+CurrentERI = list(CatalogERI['current'])
 
-ImageListHamamatsu = sorted(glob.glob(os.path.join(StartPath, ChosenHamamatsu,
-                                                   '*.raw')))
-print 'Reading Parameters from %s images in %s' % (len(ImageListERI),
+CatalogHamamatsu = imagecatalog.select(Catalog, folder=ChosenHamamatsu)
+ImageListHamamatsu = imagecatalog.filenames(CatalogHamamatsu, StartPath)
+print 'Reading Parameters from %s images in %s' % (len(ImageListHamamatsu),
                                                    bold(ChosenHamamatsu))
-VoltageHamamatsu = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                    ImageListHamamatsu]
-CurrentHamamatsu = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                    ImageListHamamatsu]
+VoltageHamamatsu = list(CatalogHamamatsu['voltage'])
+CurrentHamamatsu = list(CatalogHamamatsu['current'])
 
 # Grab closest values from the Hamamatsu data set and plot them afterwards
-CompareImages = []
-for c, i in enumerate(ImageListERI):
-    # print 80 * '-'
-    # print 'Finding best matching current from Hamamatsu for %s (%s kV, ' \
-    #       '%s mA)' % (i, VoltageERI[c], CurrentERI[c])
-    Candidates = []
-    for k in ImageListHamamatsu:
-        if str(VoltageERI[c]) + 'kV' in k:
-            Candidates.append(k)
-    IndexList = [ImageListHamamatsu.index(i) for i in Candidates]
-    # Get the closest value to the current from Hamamatsu list. Based on
-    # http://stackoverflow.com/a/9706105/323100
-    ChosenOne = min(enumerate([CurrentHamamatsu[i] for i in IndexList]),
-                    key=lambda x: abs(x[1] - CurrentERI[c]))
-    # print 'Found a match in %s' % Candidates[ChosenOne[0]]
-    CompareImages.append(Candidates[ChosenOne[0]])
-# print 80 * '-'
-VoltageMatch = [int(os.path.basename(i).split('_')[1][:-2]) for i in
-                CompareImages]
-CurrentMatch = [int(os.path.basename(i).split('_')[2][:-2]) for i in
-                CompareImages]
+Found, Matches = best_matches(VoltageERI, CurrentERI, VoltageHamamatsu,
+                              CurrentHamamatsu, ImageListERI)
+# We only compare the ERI images we found a match for
+ImageListERI = [ImageListERI[f] for f in Found]
+VoltageERI = [VoltageERI[f] for f in Found]
+CurrentERI = [CurrentERI[f] for f in Found]
+CompareImages = [ImageListHamamatsu[m] for m in Matches]
+VoltageMatch = [parse_settings(i)[1] for i in CompareImages]
+CurrentMatch = [parse_settings(i)[2] for i in CompareImages]
+
+# Crop to interesting region (slanted edge of resolution phantom)
+CropRegion = [100, 900, 575, 675]  # left
+# CropRegion = [100, 900, 1625, 1725]  # right
+# Calculate (average) Edge response, over the whole crop or only some lines
+# of it
+average = True
+if average:
+    EdgeLines = slice(None)
+else:
+    line = 400
+    width = 20
+    EdgeLines = slice(line - width, line + width)
+
+# Read the crops of all images into two stacks and calculate the edge
+# response, line spread function, its fit and the MTF of the whole sweep at
+# once
+CropsERI = read_raw_stack(ImageListERI, roi=CropRegion, verbose=True)
+CropsHamamatsu = read_raw_stack(CompareImages, roi=CropRegion, verbose=True)
+EdgeERI = mtfengine.SlantedEdge(CropsERI[:, EdgeLines])
+EdgeHamamatsu = mtfengine.SlantedEdge(CropsHamamatsu[:, EdgeLines])
 
 # Compare images
 plt.ion()
@@ -139,32 +116,15 @@ for c, i in enumerate(CompareImages):
         c + 1, len(CompareImages), VoltageERI[c], CurrentERI[c],
         bold(os.path.basename(i)),
         bold(os.path.basename(ImageListERI[c])))
-    # Load images
-    ImageERI = read_raw(ImageListERI[c])
-    ImageHamamatsu = read_raw(i)
-
-    # Crop to interesting region (slanted edge of resolution phantom)
-    CropRegion = [100, 900, 575, 675]  # left
-    # CropRegion = [100, 900, 1625, 1725]  # right
-    CropERI = ImageERI[CropRegion[0]:CropRegion[1], CropRegion[2]:CropRegion[3]]
-    CropHamamatsu = ImageHamamatsu[CropRegion[0]:CropRegion[1],
-                                   CropRegion[2]:CropRegion[3]]
-
-    # Calculate (average) Edge response
-    average = True
-    if average:
-        ResponseERI = numpy.mean(CropERI, axis=0)
-        ResponseHamamatsu = numpy.mean(CropHamamatsu, axis=0)
-    else:
-        line = 400
-        width = 20
-        ResponseERI = numpy.mean(CropERI[line - width:line + width, :], axis=0)
-        ResponseHamamatsu = numpy.mean(CropHamamatsu[line - width:line + width, :], axis=0)
+    CropERI = CropsERI[c]
+    CropHamamatsu = CropsHamamatsu[c]
+    ResponseERI = EdgeERI.esf[c]
+    ResponseHamamatsu = EdgeHamamatsu.esf[c]
 
     # Display images with region of crop
     plt.subplot(251)
     plt.title(os.path.basename(ImageListERI[c]))
-    plt.imshow(ImageERI)
+    show_preview(ImageListERI[c])
     # Draw crop region in original image
     currentAxis = plt.gca()
     currentAxis.add_patch(Rectangle((CropRegion[2], CropRegion[0]),
@@ -173,7 +133,7 @@ for c, i in enumerate(CompareImages):
                                     edgecolor='w', alpha=0.125))
     plt.subplot(256)
     plt.title(os.path.basename(i))
-    plt.imshow(ImageHamamatsu)
+    show_preview(i)
     currentAxis = plt.gca()
     currentAxis.add_patch(Rectangle((CropRegion[2], CropRegion[0]),
                                     CropRegion[3] - CropRegion[2],
@@ -208,25 +168,44 @@ for c, i in enumerate(CompareImages):
     # the averaged edge.
     # We thus calculate the average edge ($source$Response) and take the derivative
     # of this (with the `LSF` function, which uses `numpy.diff`).
-    # To the derivative we fit a gaussian function with the `gaussianfit` function
-    # which then acts as an input for the `MTF` function above.
+    # To the derivative we fit a gaussian function, whose Fourier transform is
+    # the MTF (all calculated for the whole sweep by mtfengine above).
     plt.subplot(154)
     plt.title('Line spread function')
-    plt.plot(LSF(ResponseERI), c=Colors[2], linestyle='dashed', label='ERI Data')
-    plt.plot(LSF(ResponseHamamatsu), c=Colors[3], linestyle='dashed', label='Hamamatsu Data')
-    plt.plot(gaussianfit(LSF(ResponseERI)), c=Colors[0], label='ERI fit')
-    plt.plot(gaussianfit(LSF(ResponseHamamatsu)), c=Colors[1], label='Hamamatsu fit')
+    plt.plot(EdgeERI.lsf[c], c=Colors[2], linestyle='dashed',
+             label='ERI Data')
+    plt.plot(EdgeHamamatsu.lsf[c], c=Colors[3], linestyle='dashed',
+             label='Hamamatsu Data')
+    plt.plot(EdgeERI.lsffit[c], c=Colors[0], label='ERI fit')
+    plt.plot(EdgeHamamatsu.lsffit[c], c=Colors[1], label='Hamamatsu fit')
     plt.legend(loc='best')
     plt.subplot(155)
     plt.title('MTF')
-    plt.plot(normalize(MTF(gaussianfit(LSF(ResponseERI)))), c=Colors[0],
-             label='MTF ERI')
-    plt.plot(normalize(MTF(gaussianfit(LSF(ResponseHamamatsu)))), c=Colors[1],
-             label='MTF Hamamatsu')
+    plt.plot(EdgeERI.frequencies, EdgeERI.mtf[c], c=Colors[0],
+             label='MTF ERI (MTF50: %0.2f lp/mm)' % EdgeERI.linepairs(
+                 EdgeERI.mtf50[c]))
+    plt.plot(EdgeHamamatsu.frequencies, EdgeHamamatsu.mtf[c], c=Colors[1],
+             label='MTF Hamamatsu (MTF50: %0.2f lp/mm)' %
+             EdgeHamamatsu.linepairs(EdgeHamamatsu.mtf50[c]))
+    plt.xlabel('Frequency [cycles/px]')
     plt.legend(loc='best')
     # Save figure and concatenated results
     plt.savefig(os.path.join(OutputPath, 'MTF%03dkV%03duA.png' % (VoltageERI[c], CurrentERI[c])))
     plt.draw()
     plt.pause(0.01)
+# MTF50 and MTF10 of the whole sweep
+print 80 * '-'
+print 'MTF50 and MTF10 in cycles/px (lp/mm with %s um pixels)' % \
+    mtfengine.PixelSize
+for c in range(len(CompareImages)):
+    print '%s kV/%s uA | ERI: %0.3f (%0.2f), %0.3f (%0.2f) | Hamamatsu: ' \
+        '%0.3f (%0.2f), %0.3f (%0.2f)' % (
+            VoltageERI[c], CurrentERI[c],
+            EdgeERI.mtf50[c], EdgeERI.linepairs(EdgeERI.mtf50[c]),
+            EdgeERI.mtf10[c], EdgeERI.linepairs(EdgeERI.mtf10[c]),
+            EdgeHamamatsu.mtf50[c],
+            EdgeHamamatsu.linepairs(EdgeHamamatsu.mtf50[c]),
+            EdgeHamamatsu.mtf10[c],
+            EdgeHamamatsu.linepairs(EdgeHamamatsu.mtf10[c]))
 plt.ioff()
 plt.show()
@@ -8,24 +8,58 @@ Script to plot a line through some of the regions of the resolution phantom.
 
 import numpy
 import os
-import glob
 import matplotlib.pylab as plt
 from matplotlib.patches import Rectangle
 
-import lineprofiler
-from ERIfunctions import *
+import memocache
+import imagecatalog
+from imagecontext import ImageContext
+from previewcache import show_preview
+from metricsstore import MetricsStore
 
 # Colors from 'I want hue'
 UserColors = ["#84DEBD", "#D1B9D4", "#D1D171"]
 
 StartPath = '/sls/X02DA/data/e13960/Data20/Gantry/Images'
+
+# Select three lines through resolution phantom
+LineYStart = 100
+LineLength = 850
+Coordinates = [((850, LineYStart), (850, LineYStart + LineLength)),
+               ((1150, LineYStart), (1150, LineYStart + LineLength)),
+               ((1500, LineYStart), (1500, LineYStart + LineLength))]
+# Crop region for Standard deviation
+CropSize = 900
+CropStart = [50, 700]
+
+
+def line_profiles(filename):
+    """
+    Mean and STD of the cropped region and the line profiles of one image,
+    for the metrics store
+    """
+    Context = ImageContext(filename)
+    CropStats = Context.stats([CropStart[0], CropStart[0] + CropSize,
+                               CropStart[1], CropStart[1] + CropSize])
+    Profiles = dict(('profile%s' % CoordinateCounter,
+                     Context.profile(CurrentCoordinates)) for
+                    CoordinateCounter, CurrentCoordinates in
+                    enumerate(Coordinates))
+    return {'cropmean': CropStats.mean, 'cropstd': CropStats.std()}, Profiles
+
+# The line profiles are calculated only once for each image and then kept in
+# the metrics store
+ProfileVersion = '1'
+Store = MetricsStore(os.path.join(StartPath, 'Metrics.sqlite'))
+# Read (and update) the catalog of all images
+Catalog = imagecatalog.scan(StartPath)
+Store.add_images(Catalog, StartPath)
 # Only do 'Grid' Folders
-FolderList = [i if 'Grid' in i else '' for i in sorted(os.walk(StartPath).next()[1])]
-# Disregard now emtpy list elements: http://stackoverflow.com/a/3845449
-FolderList = [x for x in FolderList if x]
+FolderList = imagecatalog.folders(imagecatalog.select(Catalog, phantom='Grid'))
 for Folder in FolderList:
     FolderToLookAt = os.path.join(StartPath, Folder)
-    ImageList = sorted(glob.glob(os.path.join(FolderToLookAt, '*.raw')))
+    FolderCatalog = imagecatalog.select(Catalog, folder=Folder)
+    ImageList = imagecatalog.filenames(FolderCatalog, StartPath)
 
     # Prepare output directory
     try:
@@ -46,29 +80,25 @@ for Folder in FolderList:
     # later on
     print 'Reading voltage and current from %s images in folder %s' % (
         len(ImageList), FolderToLookAt)
-    Voltage = [int(os.path.basename(image).split('_')[1][:-2]) for image in
-               ImageList]
-    Current = [int(os.path.basename(image).split('_')[2][:-2]) for image in
-               ImageList]
+    Voltage = FolderCatalog['voltage']
+    Current = FolderCatalog['current']
 
-    # Select three lines through resolution phantom
-    LineYStart = 100
-    LineLength = 850
-    Coordinates = [((850, LineYStart), (850, LineYStart + LineLength)),
-                   ((1150, LineYStart), (1150, LineYStart + LineLength)),
-                   ((1500, LineYStart), (1500, LineYStart + LineLength))]
     # Plot everything
     for ImageCounter, ImageName in enumerate(ImageList):
-        print '%02d/%s: Reading image %s and plotting line profiles' % (
+        print '%02d/%s: Plotting line profiles of image %s' % (
             ImageCounter + 1, len(ImageList), os.path.basename(ImageName))
-        ThisVoltage = int(os.path.basename(ImageName).split('_')[1][:-2])
-        ThisCurrent = int(os.path.basename(ImageName).split('_')[2][:-2])
+        ThisVoltage = Voltage[ImageCounter]
+        ThisCurrent = Current[ImageCounter]
         # Only do the thing if the current is not larger than the exponential
         # fit that we found with VoltageVsCurrentExponentialFit.py, which is
         # 1.05e-01 * numpy.exp(9.04e-02 * x) + 8.72e+00 (and a safety margin).
         # Or the voltage is not larger than 66 keV
         if ThisCurrent < 1.05e-1 * numpy.exp(9.04e-2 * ThisVoltage) + 20 and \
                 ThisVoltage < 66:
+            if Store.missing([ImageName], 'lineprofiles', ProfileVersion):
+                Scalars, Arrays = line_profiles(ImageName)
+                Store.store(ImageName, 'lineprofiles', ProfileVersion,
+                            Scalars, Arrays)
             # Which image are we looking at from all the ones recorded?
             plt.subplot(421)
             plt.cla()
@@ -87,12 +117,9 @@ for Folder in FolderList:
                       'and red region used for mean and STD' % (
                           ImageCounter + 1, len(ImageList),
                           os.path.basename(ImageName)))
-            Img = read_raw(ImageName)
-            plt.imshow(contrast_stretch(Img))
+            show_preview(ImageName)
             # Show where line profiles have been calculated
-            for CoordinateCounter, CurrentCoordinates in enumerate(Coordinates):
-                SelectedPoints, LineProfile = lineprofiler.lineprofile(
-                    Img, CurrentCoordinates, showimage=False)
+            for CoordinateCounter, SelectedPoints in enumerate(Coordinates):
                 plt.plot((SelectedPoints[0][0], SelectedPoints[1][0]),
                          (SelectedPoints[0][1], SelectedPoints[1][1]),
                          color=UserColors[CoordinateCounter], marker='o')
@@ -101,11 +128,10 @@ for Folder in FolderList:
                 plt.plot(SelectedPoints[1][0], SelectedPoints[1][1],
                          color='black', marker='o', alpha=0.618)
             plt.axis('off')
-            # Crop region for Standard deviation
-            CropSize = 900
-            CropStart = [50, 700]
-            Crop = Img[CropStart[0]:CropStart[0] + CropSize,
-                       CropStart[1]:CropStart[1] + CropSize]
+            CropMean = Store.values([ImageName], 'lineprofiles',
+                                    ProfileVersion, 'cropmean')[0]
+            CropSTD = Store.values([ImageName], 'lineprofiles',
+                                   ProfileVersion, 'cropstd')[0]
             # Draw crop region in original image
             currentAxis = plt.gca()
             currentAxis.add_patch(Rectangle((CropStart[1], CropStart[0]),
@@ -118,11 +144,11 @@ for Folder in FolderList:
                 if not CoordinateCounter:
                     # Title the first of the three line plots
                     plt.title('Red = mean (%0.2f) +- STD of cropped region, '
-                              'grey = mean +- 2 x STD.)' % numpy.mean(Crop))
+                              'grey = mean +- 2 x STD.)' % CropMean)
                 if 'Grid' in os.path.basename(FolderToLookAt):
                     xStart = 240
                     xShift = 320
-                    yStart = numpy.mean(Crop) + 150
+                    yStart = CropMean + 150
                     if CoordinateCounter == 2:
                         # Annotate first line profile if we have imaged the grid
                         plt.annotate('2.8 lp/mm', xy=(xStart + 1 * xShift, yStart))
@@ -145,25 +171,26 @@ for Folder in FolderList:
                         plt.annotate('4.6 lp/mm', xy=(xStart + 4 * xShift, yStart))
                 # Gray region to 2xSTD
                 plt.fill_between(range(2048),
-                                 numpy.mean(Crop) + 2 * numpy.std(Crop),
-                                 numpy.mean(Crop) - 2 * numpy.std(Crop),
+                                 CropMean + 2 * CropSTD,
+                                 CropMean - 2 * CropSTD,
                                  color='k', alpha=0.5, linewidth=1)
                 # Red region to 2xSTD
                 plt.fill_between(range(2048),
-                                 numpy.mean(Crop) + numpy.std(Crop),
-                                 numpy.mean(Crop) - numpy.std(Crop),
+                                 CropMean + CropSTD,
+                                 CropMean - CropSTD,
                                  color='r', linewidth=1)
                 # Plot mean and STD of cropped region
-                plt.axhline(numpy.mean(Crop), linestyle='-',
+                plt.axhline(CropMean, linestyle='-',
                             color='k', linewidth=1)
-                SelectedPoints, LineProfile = lineprofiler.lineprofile(
-                    Img, CurrentCoordinates, showimage=False)
+                LineProfile = Store.array(ImageName, 'lineprofiles',
+                                          ProfileVersion,
+                                          'profile%s' % CoordinateCounter)
                 plt.plot(LineProfile, color=UserColors[CoordinateCounter])
                 plt.xlim([0, len(LineProfile)])
                 plt.ylim([0, 2 ** 12])
-                plt.plot(0, numpy.mean(Crop), color='yellow', marker='o',
+                plt.plot(0, CropMean, color='yellow', marker='o',
                          markersize=15, alpha=0.618)
-                plt.plot(len(LineProfile) - 1, numpy.mean(Crop), color='black',
+                plt.plot(len(LineProfile) - 1, CropMean, color='black',
                          marker='o', markersize=15, alpha=0.618)
                 plt.xlim([0, len(LineProfile)])
                 plt.ylim([0, 2 ** 12])
@@ -179,3 +206,5 @@ for Folder in FolderList:
                                  ThisVoltage * 0.1 * numpy.exp(9.04e-2) + 10)
     plt.ioff()
     plt.close('all')
+# How much did the disk cache save us?
+memocache.Cache.report()
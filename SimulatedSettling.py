@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+SimulatedSettling.py | David Haberthür <david.haberthuer@psi.ch>
+
+Script to compare waiting a fixed time for the source to settle with the
+SettleDetector, on the simulated (drifting) source from simulatedgantry.
+For some settings of the Hamamatsu plan we acquire one image after waiting
+the fixed 5 seconds and one after the SettleDetector told us the source has
+settled, and compare the time we waited and how far the brightness of the
+images is from the one of the fully settled source.
+"""
+
+import os
+import tempfile
+import time
+import shutil
+
+import acquisitionplan
+from ERIfunctions import read_raw
+from imagestatistics import ImageStats
+from settledetector import SettleDetector
+from simulatedgantry import sb, tube
+
+FixedSettleTime = 5
+DetectorExposureTime = 1
+ROI = (412, 612, 924, 1124)
+Settings, Dropped = acquisitionplan.plan(range(25, 65), range(10, 201, 5),
+                                         seed=1)
+Settings = Settings[::200]
+
+# We compare the mean brightness of the images, without a phantom or hot
+# pixels in the way
+sb.phantom = None
+sb.hotpixels = 0
+OutPutPath = tempfile.mkdtemp()
+tube.on()
+sb.start()
+sb.set_exposure_time(DetectorExposureTime * 1000)
+Settler = SettleDetector(sb, OutPutPath, DetectorExposureTime,
+                         probeexposure=0.2, roi=ROI,
+                         ceiling=FixedSettleTime)
+
+
+def brightness_error(prefix, voltage, current):
+    """
+    Acquire one image and return how far (relative) its brightness is from
+    the fully settled source
+    """
+    sb.set_directory(OutPutPath)
+    sb.set_prefix(prefix)
+    sb.acquire(1, 2)
+    image = read_raw(os.path.join(OutPutPath, prefix + '_01.raw'),
+                     memmap=True)
+    settled = tube.target() * DetectorExposureTime + sb.offset
+    return (ImageStats(image, roi=ROI).mean - settled) / settled
+
+FixedTime = AdaptiveTime = 0
+for counter, (voltage, current) in enumerate(Settings):
+    results = []
+    for method in ('fixed', 'adaptive'):
+        tube.set_voltage(voltage)
+        tube.set_current(current)
+        start = time.time()
+        if method == 'fixed':
+            time.sleep(FixedSettleTime)
+            FixedTime += time.time() - start
+        else:
+            Settler.wait()
+            AdaptiveTime += time.time() - start
+        results.append((time.time() - start, brightness_error(
+            method, voltage, current)))
+        # Go somewhere else, so that both methods start from the same
+        # distance to the setting
+        tube.set_voltage(25)
+        tube.set_current(10)
+        time.sleep(3 * tube.settletime)
+    print '%s/%s | %s kV/%s uA | fixed: %0.1f s (%+0.2f%%), adaptive: ' \
+          '%0.1f s (%+0.2f%%)' % (counter + 1, len(Settings), voltage,
+                                  current, results[0][0],
+                                  100 * results[0][1], results[1][0],
+                                  100 * results[1][1])
+print 'Waited %0.1f s with the fixed settle time and %0.1f s with the ' \
+      'SettleDetector' % (FixedTime, AdaptiveTime)
+shutil.rmtree(OutPutPath)
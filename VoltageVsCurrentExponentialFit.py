@@ -7,12 +7,13 @@ see an exponential connection. This script fits the curves.
 """
 
 import os
-import glob
 import matplotlib.pylab as plt
 import numpy
 import scipy.optimize
 import scipy.stats
 
+import imagecatalog
+
 
 def fitting_function(x, a, b, c):
     return a * numpy.exp(b * x) + c
@@ -27,7 +28,8 @@ def rand_jitter(arr):
     return arr + numpy.random.randn(len(arr)) * stdev
 
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry', 'Images')
-ERIFolders = sorted(glob.glob(os.path.join(StartPath, 'ERI*')))
+Catalog = imagecatalog.select(imagecatalog.scan(StartPath), source='ERI')
+ERIFolders = imagecatalog.folders(Catalog)
 
 # Colors from 'I want hue!'
 colors = ["#BEDB87",
@@ -47,27 +49,20 @@ plt.rc('lines', linewidth=2, marker='o')
 plt.rc('axes', grid=True)
 
 # Grab all images and plot values for folders
-ImageList = []
-AllImages = []
 plt.figure(figsize=[16, 9])
 for counter, folder in enumerate(ERIFolders):
     print 'Reading values from folder %s/%s: %s' % (counter + 1,
                                                     len(ERIFolders),
                                                     os.path.basename(folder))
-    ImageList = sorted(glob.glob(os.path.join(StartPath, folder, '*.raw')))
-    AllImages += ImageList
-    Voltage = numpy.array([int(os.path.basename(image).split('_')[1][:-2]) for
-                           image in ImageList])
-    Current = numpy.array([int(os.path.basename(image).split('_')[2][:-2]) for
-                           image in ImageList])
+    FolderCatalog = imagecatalog.select(Catalog, folder=folder)
+    Voltage = FolderCatalog['voltage'].astype(numpy.float)
+    Current = FolderCatalog['current'].astype(numpy.float)
     plt.scatter(rand_jitter(Voltage), rand_jitter(Current), c=colors[counter],
                 label=os.path.basename(folder))
 # Exponential fit for *all* images
 InitialGuess = (0.05, 1e-1, 10)
-Voltage = numpy.array([int(os.path.basename(image).split('_')[1][:-2]) for
-                       image in AllImages])
-Current = numpy.array([int(os.path.basename(image).split('_')[2][:-2]) for
-                       image in AllImages])
+Voltage = Catalog['voltage'].astype(numpy.float)
+Current = Catalog['current'].astype(numpy.float)
 try:
     try:
         OptimalValues, Covariance = scipy.optimize.curve_fit(fitting_function,
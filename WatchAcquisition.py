@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+WatchAcquisition.py | David Haberthür <david.haberthuer@psi.ch>
+
+Script to analyze the images while David.Experiment.ERI.py or
+David.Experiment.Hamamatsu.py are still acquiring them.
+We watch the folders they write into and, as soon as an image is complete,
+calculate its brightness and MTF (into the metrics store) and flat-field
+correct it (into a projection stack next to the images). Just leave it
+running next to the acquisition and stop it with Ctrl-C.
+"""
+
+import os
+import numpy
+
+import imagecatalog
+from ERIfunctions import parse_exposure
+from framewatcher import FrameWatcher, complete_frames
+from imagecontext import ImageContext
+from metricsstore import MetricsStore
+from masterframes import cached_master_frame, DarkLibrary
+from flatfield import flatfield_gain, correct, image_metadata
+from projectionstack import ProjectionStack
+
+# The acquisition scripts save the images in 'ERI' and 'Hamamatsu' in here
+StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry')
+WatchFolders = ['ERI', 'Hamamatsu']
+# Seconds between looking for new images
+PollInterval = 2
+# Stop if no new image came in for this many seconds (None: never stop)
+IdleTime = None
+# Slanted edge of the resolution phantom, for the MTF
+CropRegion = [100, 900, 575, 675]
+# Darks and flats for the flat-field correction. If we do not have flats
+# (FlatFolder = None), we do not correct the images.
+DarkFolder = os.path.join(StartPath, 'Images', 'Darks')
+FlatFolder = None
+
+# Everything we calculate goes into the metrics store in the image folder,
+# which CompareBrightness.py and ResolutionPlotter.py read, with the same
+# analysis names. Once the images are moved into the image folder, the store
+# finds the values we calculated here (see MetricsStore.add_images).
+BrightnessVersion = '1'
+MTFVersion = '3'
+Store = MetricsStore(os.path.join(StartPath, 'Images', 'Metrics.sqlite'))
+
+if FlatFolder:
+    print 'Calculating master flat from the images in %s' % FlatFolder
+    Darks = DarkLibrary(DarkFolder, verbose=True)
+    Flat = cached_master_frame(sorted(os.path.join(FlatFolder, f) for f in
+                                      os.listdir(FlatFolder) if
+                                      f.endswith('.raw')), verbose=True)
+    # Dark and gain for each exposure time we get images with
+    Gains = {}
+    Stacks = dict((Folder, ProjectionStack(os.path.join(
+        StartPath, Folder, 'Corrected'))) for Folder in WatchFolders)
+    # Do not append images we have corrected in an earlier run again
+    Corrected = set(os.path.join(StartPath, Folder, Image['name']) for
+                    Folder in WatchFolders for Image in Stacks[Folder].images)
+else:
+    print 'No flats given, we do not flat-field correct the images'
+
+
+def process(filename):
+    """
+    Analyze one complete image
+    """
+    Folder = os.path.basename(os.path.dirname(filename))
+    # Add the image to the store, so that we can query by its settings
+    Store.add_images(numpy.array([imagecatalog.catalog_entry(
+        Folder, os.path.basename(filename), os.stat(filename))],
+        dtype=imagecatalog.CatalogType), StartPath)
+    Context = ImageContext(filename)
+    Stats = Context.stats()
+    Store.store(filename, 'brightness', BrightnessVersion,
+                {'mean': Stats.mean, 'std': Stats.std(ddof=0)})
+    Edge = Context.slanted_edge(CropRegion)
+    if Edge.valid[0]:
+        Store.store(filename, 'slantededge', MTFVersion,
+                    {'sigma': Edge.sigma[0], 'mtf50': Edge.mtf50[0],
+                     'mtf10': Edge.mtf10[0]},
+                    {'lsf': Edge.lsf[0], 'lsffit': Edge.lsffit[0],
+                     'mtf': Edge.mtf[0]})
+        print '\tBrightness %0.1f +- %0.1f, MTF50 %0.2f lp/mm' % (
+            Stats.mean, Stats.std(), Edge.linepairs(Edge.mtf50[0]))
+    else:
+        # Without an edge in the crop there is no MTF we could store
+        print '\tBrightness %0.1f +- %0.1f, no slanted edge in %s' % (
+            Stats.mean, Stats.std(), CropRegion)
+    if FlatFolder and filename not in Corrected:
+        Exposure = parse_exposure(filename)
+        if Exposure not in Gains:
+            Dark = numpy.asarray(Darks.dark(Exposure), dtype=numpy.float32)
+            Gains[Exposure] = Dark, flatfield_gain(Dark, Flat)
+        Dark, Gain = Gains[Exposure]
+        Stacks[Folder].append(correct(Context.image[numpy.newaxis], Dark,
+                                      Gain), [image_metadata(filename)])
+        Corrected.add(filename)
+
+# Images we have analyzed in an earlier run are not analyzed again
+Folders = [os.path.join(StartPath, Folder) for Folder in WatchFolders]
+Existing = [f for Folder in Folders for f in complete_frames(Folder)]
+Done = set(Existing) - set(Store.missing(Existing, 'brightness',
+                                         BrightnessVersion))
+print 'Watching %s for new images (%s images already analyzed)' % (
+    ' and '.join(Folders), len(Done))
+Watcher = FrameWatcher(Folders, seen=Done)
+Processed = Watcher.watch(process, interval=PollInterval, idle=IdleTime,
+                          verbose=True)
+print 'Analyzed %s new images' % Processed
+Store.close()
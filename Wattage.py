@@ -5,31 +5,22 @@ Quickly calculate the output power of the ERI source for all experiments
 """
 
 import os
-import glob
 import matplotlib.pylab as plt
 import numpy
 import scipy.optimize
 import scipy.stats
 
 from ERIfunctions import *
+import imagecatalog
 
 StartPath = os.path.join(os.path.expanduser('~'), 'Data20', 'Gantry', 'Images')
-ERIFolders = sorted(glob.glob(os.path.join(StartPath, 'ERI*')))
 
-
-# Grab all images and plot values for folders
-ImageList = []
-AllImages = []
-for counter, folder in enumerate(ERIFolders):
-    print 'Reading kV and uA values from folder %s/%s: %s' % (counter + 1,
-                                                              len(ERIFolders),
-                                                              os.path.basename(folder))
-    ImageList = sorted(glob.glob(os.path.join(StartPath, folder, '*.raw')))
-    AllImages += ImageList
-Voltage = numpy.array([int(os.path.basename(image).split('_')[1][:-2]) for
-                       image in AllImages])
-Current = numpy.array([int(os.path.basename(image).split('_')[2][:-2]) for
-                       image in AllImages])
+# Grab kV and uA values of all images in all the ERI folders
+print 'Reading kV and uA values from the catalog of %s' % StartPath
+Catalog = imagecatalog.select(imagecatalog.scan(StartPath), source='ERI')
+AllImages = imagecatalog.filenames(Catalog, StartPath)
+Voltage = Catalog['voltage'].astype(numpy.int)
+Current = Catalog['current'].astype(numpy.int)
 Watt = Voltage * 1e3 * Current * 1e-6
 
 print
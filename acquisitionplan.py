@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Plan of the (kV, uA) settings we acquire images at with the Hamamatsu source.
+We make the full plan before we start: settings the source cannot do
+according to its data sheet are dropped, and the remaining ones are ordered
+so that the source has to change as little as possible from one setting to
+the next, while the order is still random enough that hysteresis of the
+source does not end up in our data.
+With a simple model of how long the source takes to settle, we can then
+tell how long the whole run takes, before we start the warm-up.
+"""
+
+import random
+
+# Time model of the source and detector [s]: after each change the source
+# settles for 'SettleTime', plus the time it needs to ramp the voltage and
+# current. Each image takes the exposure time plus 'ReadoutTime'.
+SettleTime = 5
+RampVoltage = 0.2  # per kV
+RampCurrent = 0.02  # per uA
+ReadoutTime = 2
+
+
+def feasible(voltage, current):
+    """
+    Can we safely operate the Hamamatsu source at this setting, according to
+    its data sheet?
+    """
+    return not (voltage < 40 and current > 100)
+
+
+def transition_time(previous, setting):
+    """
+    Time [s] it takes to go from the (kV, uA) setting 'previous' to
+    'setting' (None for the first setting) until the source has settled
+    """
+    if previous is None:
+        return SettleTime
+    if previous == setting:
+        return 0
+    return SettleTime + RampVoltage * abs(setting[0] - previous[0]) + \
+        RampCurrent * abs(setting[1] - previous[1])
+
+
+def plan(voltages, currents, blocksize=5, seed=None):
+    """
+    Return the ordered list of feasible (kV, uA) settings and the list of
+    settings we dropped.
+    We sort the voltages into blocks of 'blocksize' neighbouring voltages and
+    go through the blocks in random order. In each block we step through the
+    voltages upwards or downwards (randomly) and for each voltage sweep
+    through all currents, alternating up and down, so that we only change
+    the current by one step most of the time.
+    """
+    generator = random.Random(seed)
+    voltages = sorted(set(voltages))
+    currents = sorted(set(currents))
+    dropped = [(v, c) for v in voltages for c in currents if
+               not feasible(v, c)]
+    blocks = [voltages[start:start + blocksize] for start in
+              range(0, len(voltages), blocksize)]
+    generator.shuffle(blocks)
+    settings = []
+    for block in blocks:
+        if generator.random() < 0.5:
+            block = block[::-1]
+        for voltage in block:
+            sweep = [c for c in currents if feasible(voltage, c)]
+            # Start the sweep at the end which is closer to where we are
+            if settings and abs(sweep[-1] - settings[-1][1]) < \
+                    abs(sweep[0] - settings[-1][1]):
+                sweep = sweep[::-1]
+            settings.extend((voltage, c) for c in sweep)
+    return settings, dropped
+
+
+def predicted_time(settings, exposure, overlap=False):
+    """
+    Predicted time [s] to acquire one image with 'exposure' seconds at each
+    of the settings, in this order. With overlap=True, the readout of each
+    image happens while the source goes to the next setting (like in the
+    AcquisitionRunner), so we only wait for the longer of the two.
+    """
+    total = 0
+    previous = None
+    for setting in settings:
+        if overlap and previous is not None:
+            total += max(transition_time(previous, setting), ReadoutTime)
+        else:
+            total += transition_time(previous, setting)
+            if previous is not None:
+                total += ReadoutTime
+        total += exposure
+        previous = setting
+    return total + ReadoutTime
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run the acquisition of a list of source settings with the ShadoBox.
+Each image goes through four stages: we command the source to the new
+setting, wait until the source has settled, expose the detector and then
+read out and verify the image. Readout and verification of one image only
+need the detector and the disk, so we can overlap them with the source
+change and settling for the next image. The time each stage takes is logged, so
+that we see where the time of a run goes.
+"""
+
+import os
+import threading
+import time
+import Queue
+
+from framewatcher import FrameSize
+
+
+class AcquisitionRunner(object):
+    """
+    Acquire one image with 'detector' (the ShadoBox 'sb' from gantry_control
+    or a stand-in from simulatedgantry) for each setting, saved in
+    'directory' as '<sourcename>_VVVkV_CCCuA_EEsExp_01.raw'.
+    'setsource(setting)' commands the source to one of the settings and
+    returns the (kV, uA) it is running at. After it, we wait 'settletime'
+    seconds for the source to settle, or, if we get a 'settler' (a
+    SettleDetector), until it tells us the source has settled. We change the
+    source as soon as the exposure of the last image is over, while the
+    detector still reads out; with overlap=False we do everything strictly
+    one after the other, which is the default. We only know the exposure is
+    over once the detector starts writing the image (or is done with it), so
+    we wait for this and then for a safety 'margin' [s]. Just waiting for the
+    exposure time would change the source during the exposure whenever the
+    detector needs a while to start it. That the ShadoBox only writes the
+    image after the exposure is over has not been verified on the hardware
+    yet, so only use overlap=True where it has been.
+    The settler needs the detector for its probe images, so with a settler
+    we only overlap the readout with the source command. If the probes are
+    too slow to ever beat the fixed 'settletime' (see SettleDetector.useful),
+    we do without the settler and keep the full overlap.
+    Each complete image is added to the 'checkpoint' (see acquisitionstate),
+    if we get one.
+    """
+
+    def __init__(self, detector, sourcename, directory, exposure, setsource,
+                 settletime=5, settler=None, margin=0.5, overlap=False,
+                 log=None, checkpoint=None, expectedsize=FrameSize,
+                 verifytimeout=30):
+        self.detector = detector
+        self.sourcename = sourcename
+        self.directory = directory
+        self.exposure = exposure
+        self.setsource = setsource
+        self.settletime = settletime
+        self.settler = settler
+        self.margin = margin
+        self.overlap = overlap
+        self.log = log
+        self.checkpoint = checkpoint
+        self.expectedsize = expectedsize
+        self.verifytimeout = verifytimeout
+        # (prefix, stage, duration) of everything we did
+        self.timings = []
+        # Images which did not end up on disk completely
+        self.failed = []
+        self.error = None
+        self.verifyqueue = Queue.Queue()
+
+    def timing(self, prefix, stage, duration):
+        self.timings.append((prefix, stage, duration))
+        if self.log:
+            self.log.info('%s | %s took %0.2f s', prefix, stage, duration)
+
+    def acquire(self, index, prefix):
+        """
+        Expose and read out the image of setting 'index' (runs in its own
+        thread)
+        """
+        start = time.time()
+        try:
+            self.detector.acquire(1, 2)
+        except Exception as error:
+            self.error = error
+            return
+        self.timing(prefix, 'readout', time.time() - start - self.exposure)
+        self.verifyqueue.put((index, prefix, time.time()))
+
+    def wait_for_readout(self, acquisition, prefix):
+        """
+        Wait until the detector has started to write the image, i.e. until
+        its exposure is over, or until the 'acquisition' thread is done
+        """
+        filename = os.path.join(self.directory, prefix + '_01.raw')
+        while acquisition.is_alive() and not os.path.exists(filename):
+            time.sleep(0.05)
+
+    def verify(self):
+        """
+        Check that each image has been written completely (runs in its own
+        thread until it gets None)
+        """
+        while True:
+            item = self.verifyqueue.get()
+            if item is None:
+                return
+            index, prefix, readout = item
+            filename = os.path.join(self.directory, prefix + '_01.raw')
+            while time.time() - readout < self.verifytimeout:
+                if os.path.exists(filename) and \
+                        os.path.getsize(filename) == self.expectedsize:
+                    break
+                time.sleep(0.1)
+            else:
+                self.failed.append(filename)
+                print 'Image %s has not been written completely' % filename
+                if self.log:
+                    self.log.warning('Image %s has not been written '
+                                     'completely', filename)
+            self.timing(prefix, 'verify', time.time() - readout)
+            if filename in self.failed:
+                continue
+            if self.checkpoint is not None:
+                self.checkpoint.add(index, os.path.basename(filename))
+            if self.log:
+                self.log.info('Image %s (%s) acquired at %s', index + 1,
+                              prefix + '.raw',
+                              time.strftime('%d.%m.%Y at %H:%M:%S'))
+
+    def run(self, settings, indices=None):
+        """
+        Acquire one image for each of the settings, or, when resuming a run,
+        only for the settings with the given 'indices'. Returns the list of
+        images which were not written completely.
+        """
+        if indices is None:
+            indices = range(len(settings))
+        verifier = threading.Thread(target=self.verify)
+        verifier.start()
+        acquisition = None
+        runstart = time.time()
+        try:
+            for counter, index in enumerate(indices):
+                setting = settings[index]
+                print 80 * '-'
+                # The detector is still reading out the last image while we
+                # change the source
+                start = time.time()
+                voltage, current = self.setsource(setting)
+                prefix = '%s_%03dkV_%03duA_%ssExp' % (
+                    self.sourcename, voltage, current, self.exposure)
+                self.timing(prefix, 'source', time.time() - start)
+                print '%s | %s/%s | %s kV/%s uA | %s' % (
+                    self.sourcename, counter + 1, len(indices), voltage,
+                    current, time.strftime('%d.%m.%Y at %H:%M:%S'))
+                probe = self.settler is not None and self.settler.useful()
+                if acquisition is not None and probe:
+                    # We need the detector for the probe images
+                    start = time.time()
+                    acquisition.join()
+                    acquisition = None
+                    self.timing(prefix, 'detector wait', time.time() - start)
+                start = time.time()
+                if probe:
+                    print 'Waiting until the source has settled (at most ' \
+                          '%s seconds)...' % self.settler.ceiling
+                    self.settler.wait()
+                elif self.settletime:
+                    print 'Waiting for %s seconds until the source has ' \
+                          'settled...' % self.settletime
+                    time.sleep(self.settletime)
+                self.timing(prefix, 'settle', time.time() - start)
+                if acquisition is not None:
+                    start = time.time()
+                    acquisition.join()
+                    self.timing(prefix, 'detector wait', time.time() - start)
+                if self.error is not None:
+                    raise self.error
+                self.detector.set_directory(self.directory)
+                self.detector.set_prefix(prefix)
+                print 'Acquiring image for %s seconds' % self.exposure
+                start = time.time()
+                acquisition = threading.Thread(target=self.acquire,
+                                               args=(index, prefix))
+                acquisition.start()
+                if self.overlap:
+                    # Wait until the exposure is over, the readout happens
+                    # while we set up the next setting
+                    self.wait_for_readout(acquisition, prefix)
+                    time.sleep(self.margin)
+                else:
+                    acquisition.join()
+                self.timing(prefix, 'expose', time.time() - start)
+            if acquisition is not None:
+                acquisition.join()
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.verifyqueue.put(None)
+            verifier.join()
+        self.timing(self.sourcename, 'whole run', time.time() - runstart)
+        return self.failed
+
+    def summary(self):
+        """
+        Print how much time we spent in each stage
+        """
+        totals = {}
+        for prefix, stage, duration in self.timings:
+            totals[stage] = totals.get(stage, 0) + duration
+        for stage in sorted(totals):
+            print '%s: %0.1f s' % (stage, totals[stage])
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+State of an acquisition run on disk, so that we can resume it after a crash.
+Before a run, we save its plan (the settings in the order we acquire them
+and the seed we shuffled them with) next to the log file. Each image which
+has been written completely is appended to a checkpoint file. When resuming,
+we compare the plan with the checkpoint and the images on disk and only
+acquire what is missing.
+"""
+
+import glob
+import json
+import os
+
+from ERIfunctions import atomic_write
+from framewatcher import FrameSize
+
+
+def save_plan(filename, sourcename, exposure, settings, seed):
+    """
+    Save the plan of a run as JSON
+    """
+    with atomic_write(filename, 'w') as planfile:
+        json.dump({'source': sourcename, 'exposure': exposure, 'seed': seed,
+                   'settings': settings}, planfile, indent=1)
+
+
+def load_plan(filename):
+    """
+    Load the plan of a run, returns the settings and the seed. Settings are
+    either a voltage or a (voltage, current) tuple, like we planned them.
+    """
+    with open(filename) as planfile:
+        plan = json.load(planfile)
+    settings = [tuple(s) if isinstance(s, list) else s for s in
+                plan['settings']]
+    return settings, plan['seed']
+
+
+class Checkpoint(object):
+    """
+    Append-only list of the images we completed, with the index of their
+    setting in the plan. We only ever append one line per image, so a crash
+    while writing can at most break the last line, which we then ignore.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.completed = {}
+        if os.path.exists(filename):
+            with open(filename) as checkpointfile:
+                for line in checkpointfile:
+                    try:
+                        index, image = line.rstrip('\n').split(' ', 1)
+                        self.completed[int(index)] = image
+                    except ValueError:
+                        # Broken last line
+                        continue
+
+    def add(self, index, image):
+        self.completed[index] = image
+        with open(self.filename, 'a') as checkpointfile:
+            checkpointfile.write('%s %s\n' % (index, image))
+            checkpointfile.flush()
+            os.fsync(checkpointfile.fileno())
+
+
+def image_pattern(sourcename, setting, exposure):
+    """
+    Pattern of the file name of the image we acquire for a setting. For the
+    ERI source we only plan the voltage, the current is entered during the
+    run.
+    """
+    if isinstance(setting, tuple):
+        voltage, current = setting
+        return '%s_%03dkV_%03duA_%ssExp_01.raw' % (sourcename, voltage,
+                                                   current, exposure)
+    return '%s_%03dkV_*uA_%ssExp_01.raw' % (sourcename, setting, exposure)
+
+
+def reconcile(settings, directory, sourcename, exposure, checkpoint,
+              expectedsize=FrameSize, verbose=False):
+    """
+    Return the indices of the settings which we still need to acquire.
+    A setting is done if we find a complete image for it on disk, whether it
+    made it into the checkpoint or not. Incomplete images are renamed to
+    '.incomplete', so that we do not mistake them for data later.
+    """
+    todo = []
+    for index, setting in enumerate(settings):
+        complete = None
+        for filename in sorted(glob.glob(os.path.join(
+                directory, image_pattern(sourcename, setting, exposure)))):
+            if os.path.getsize(filename) == expectedsize:
+                complete = filename
+            else:
+                if verbose:
+                    print 'Image %s is incomplete, we acquire it again' % \
+                        filename
+                os.rename(filename, filename + '.incomplete')
+        if complete is None:
+            if verbose and index in checkpoint.completed:
+                print 'Image %s is missing, we acquire it again' % \
+                    checkpoint.completed[index]
+            todo.append(index)
+        elif index not in checkpoint.completed:
+            checkpoint.add(index, os.path.basename(complete))
+    return todo
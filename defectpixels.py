@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hot, dead and noisy pixels of the ShadoBox.
+We find them once from the statistics of darks (and flats) and save them as a
+bit mask. For each defective pixel we then precompute the indices of its
+closest good neighbours, so that read_raw can replace all defective pixels
+of an image with the median of their neighbours with one fancy-indexing
+step.
+"""
+
+import numpy
+import scipy.ndimage
+
+
+def outliers(values, threshold):
+    """
+    Find the values further than 'threshold' robust standard deviations
+    (estimated from the median absolute deviation) from the median
+    """
+    median = numpy.median(values)
+    mad = 1.4826 * numpy.median(numpy.abs(values - median))
+    return numpy.abs(values - median) > threshold * max(mad, 1e-6)
+
+
+def defect_map(darkmean, darkstd=None, flatmean=None, threshold=6):
+    """
+    Find the defective pixels of the detector. Pixels are defective if
+    - their mean dark value sticks out from their surrounding (hot pixels)
+    - their noise in the darks sticks out (noisy pixels) or
+    - their response in the flats (flat - dark) sticks out from their
+      surrounding (dead or overly sensitive pixels).
+    The function returns a boolean image, True for defective pixels.
+    """
+    darkmean = numpy.asarray(darkmean, dtype=numpy.float64)
+    defects = outliers(darkmean - scipy.ndimage.median_filter(darkmean, 5),
+                       threshold)
+    if darkstd is not None:
+        defects |= outliers(numpy.asarray(darkstd), threshold)
+    if flatmean is not None:
+        response = numpy.asarray(flatmean, dtype=numpy.float64) - darkmean
+        background = numpy.maximum(
+            scipy.ndimage.median_filter(response, 5), 1)
+        defects |= outliers(response / background, threshold)
+    return defects
+
+
+def save_defect_map(filename, defects):
+    """
+    Save the map of defective pixels as a bit mask
+    """
+    numpy.savez(filename, bits=numpy.packbits(defects),
+                shape=defects.shape)
+
+
+def load_defect_map(filename):
+    """
+    Load the map of defective pixels saved with save_defect_map
+    """
+    with numpy.load(filename) as stored:
+        shape = tuple(stored['shape'])
+        return numpy.unpackbits(stored['bits'])[:numpy.prod(shape)].reshape(
+            shape).astype(bool)
+
+
+def defect_replacement(defects, neighbours=8, radius=2):
+    """
+    Precompute the replacement of defective pixels for read_raw(...,
+    defects=...). For each defective pixel we look for the 'neighbours'
+    closest good pixels within 'radius'. If there are less good ones, we
+    repeat them, if there are none, the pixel is left as it is.
+    The function returns the (rows, columns) of the defective pixels and the
+    (rows, columns) of their neighbours, each with one row per defective
+    pixel.
+    """
+    rows, columns = numpy.nonzero(defects)
+    # All offsets around a pixel, sorted by distance
+    offsets = [(r, c) for r in range(-radius, radius + 1) for c in
+               range(-radius, radius + 1) if r or c]
+    offsets = numpy.array(sorted(offsets, key=lambda o: numpy.hypot(*o)))
+    neighbourrows = rows[:, numpy.newaxis] + offsets[:, 0]
+    neighbourcolumns = columns[:, numpy.newaxis] + offsets[:, 1]
+    inside = (neighbourrows >= 0) & (neighbourrows < defects.shape[0]) & \
+             (neighbourcolumns >= 0) & (neighbourcolumns < defects.shape[1])
+    neighbourrows = numpy.clip(neighbourrows, 0, defects.shape[0] - 1)
+    neighbourcolumns = numpy.clip(neighbourcolumns, 0, defects.shape[1] - 1)
+    good = inside & ~defects[neighbourrows, neighbourcolumns]
+    # Sort the good neighbours to the front, keeping them sorted by distance
+    order = numpy.argsort(~good, axis=1, kind='mergesort')
+    pixel = numpy.arange(len(rows))[:, numpy.newaxis]
+    neighbourrows = neighbourrows[pixel, order]
+    neighbourcolumns = neighbourcolumns[pixel, order]
+    # Use the first 'neighbours' good ones, repeating them if necessary
+    count = numpy.sum(good, axis=1)
+    use = numpy.arange(neighbours) % numpy.maximum(count, 1)[:, numpy.newaxis]
+    neighbourrows = neighbourrows[pixel, use]
+    neighbourcolumns = neighbourcolumns[pixel, use]
+    # Pixels without any good neighbour are 'replaced' by themselves
+    neighbourrows[count == 0] = rows[count == 0, numpy.newaxis]
+    neighbourcolumns[count == 0] = columns[count == 0, numpy.newaxis]
+    return (rows, columns), (neighbourrows, neighbourcolumns)
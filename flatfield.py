@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Flat-field correction of projections with master darks and flats.
+P=-ln((P-D)/(F-D)), while D and F are mean darks and mean flats
+
+Since the ERI source drifts between the flats and the projections, we can
+also do a dynamic flat-field correction, where F is fitted to each
+projection from the principal components ('eigen flats') of all the flats.
+See Van Nieuwenhove et al., Optics Express 23(21), 2015,
+http://dx.doi.org/10.1364/OE.23.027975
+"""
+
+import multiprocessing
+import os
+import numpy
+
+from ERIfunctions import read_raw_stack, parse_settings
+from projectionstack import write_chunk
+
+
+def flatfield_gain(dark, flat):
+    """
+    Calculate 1/(F-D) once, in float32, so that we only need to multiply
+    each projection with it. Pixels where F-D is not positive (dead or
+    saturated pixels) cannot be corrected and get a gain of zero.
+    """
+    denominator = numpy.subtract(flat, dark, dtype=numpy.float32)
+    gain = numpy.zeros(denominator.shape, dtype=numpy.float32)
+    numpy.divide(1, denominator, out=gain, where=denominator > 0)
+    return gain
+
+
+def correct(projections, dark, gain, invalid=numpy.nan):
+    """
+    Flat-field correct a (N, height, width) chunk of projections, with the
+    dark and gain from flatfield_gain. We work in place on a float32 copy of
+    the chunk. Pixels where either F-D or P-D are not positive cannot be
+    corrected (the logarithm is undefined) and are set to 'invalid'.
+    """
+    chunk = numpy.asarray(projections).astype(numpy.float32)
+    chunk -= dark
+    chunk *= gain
+    undefined = ~(chunk > 0)
+    chunk[undefined] = 1
+    numpy.log(chunk, out=chunk)
+    numpy.negative(chunk, out=chunk)
+    chunk[undefined] = invalid
+    return chunk
+
+
+def eigenflats(filenames, components=10, width=2048, height=1024,
+               memory=2 ** 30, verbose=False):
+    """
+    Calculate the mean flat and the first 'components' principal components
+    of a list of flat .raw files, without having all flats in memory.
+    We go through all flats in bands of rows and accumulate the (small,
+    N x N) Gram matrix of the mean-subtracted flats, whose eigenvectors give
+    us the principal components. In a second pass over the bands we then
+    calculate the eigen flats from them.
+    The function returns the mean flat (height, width) and the eigen flats
+    (components, height, width), both as float32.
+    """
+    # A float32 copy and the uint16 stack of each band
+    bandheight = int(min(max(memory // (len(filenames) * width * 6), 1),
+                         height))
+    bands = range(0, height, bandheight)
+    meanflat = numpy.empty((height, width), dtype=numpy.float32)
+    gram = numpy.zeros((len(filenames), len(filenames)))
+    if verbose:
+        print 'Calculating Gram matrix of %s flats in %s bands' % (
+            len(filenames), len(bands))
+    for top in bands:
+        bottom = min(top + bandheight, height)
+        band = read_raw_stack(filenames, roi=[top, bottom, 0, width],
+                              width=width,
+                              height=height).astype(numpy.float32)
+        meanflat[top:bottom] = numpy.mean(band, axis=0)
+        band -= meanflat[top:bottom]
+        band = band.reshape(len(filenames), -1)
+        gram += numpy.dot(band, band.T)
+    # Eigenvectors of the Gram matrix, sorted by decreasing eigenvalue. Only
+    # use the components which actually contain some variation.
+    eigenvalues, eigenvectors = numpy.linalg.eigh(gram)
+    order = numpy.argsort(eigenvalues)[::-1]
+    eigenvalues = eigenvalues[order][:min(components, len(filenames) - 1)]
+    eigenvalues = eigenvalues[eigenvalues > 1e-6 * eigenvalues[0]]
+    eigenvectors = eigenvectors[:, order][:, :len(eigenvalues)]
+    weights = (eigenvectors / numpy.sqrt(eigenvalues)).T.astype(
+        numpy.float32)
+    if verbose:
+        print 'Calculating %s eigen flats' % len(eigenvalues)
+    flats = numpy.empty((len(eigenvalues), height, width),
+                        dtype=numpy.float32)
+    for top in bands:
+        bottom = min(top + bandheight, height)
+        band = read_raw_stack(filenames, roi=[top, bottom, 0, width],
+                              width=width,
+                              height=height).astype(numpy.float32)
+        band -= meanflat[top:bottom]
+        flats[:, top:bottom] = numpy.dot(
+            weights, band.reshape(len(filenames), -1)).reshape(
+            len(eigenvalues), bottom - top, width)
+    return meanflat, flats
+
+
+def dynamic_gain(projections, dark, flat, eigenflats, fitregion, fitstep=8):
+    """
+    Fit a flat to each projection of a (N, height, width) chunk and return
+    1/(F-D) for each one of them, like flatfield_gain.
+    F-D is modeled as 'flat' (the mean flat minus the dark) plus a weighted
+    sum of the eigen flats. The weights of all projections are found at once
+    with one least squares fit on every 'fitstep'th pixel of the 'fitregion'
+    [top, bottom, left, right], which has to be a region without sample.
+    Fitted over the sample, the eigen flats would partly model the sample
+    and the correction gets worse than with a static flat.
+    """
+    top, bottom, left, right = fitregion
+    rows = slice(top, bottom, fitstep)
+    columns = slice(left, right, fitstep)
+    basis = eigenflats[:, rows, columns].reshape(len(eigenflats), -1).T
+    residual = numpy.asarray(projections)[:, rows, columns].astype(
+        numpy.float32) - dark[rows, columns] - flat[rows, columns]
+    weights = numpy.linalg.lstsq(basis, residual.reshape(
+        len(residual), -1).T, rcond=None)[0].T.astype(numpy.float32)
+    flats = flat + numpy.tensordot(weights, eigenflats, axes=1)
+    return flatfield_gain(0, flats)
+
+
+# Dark, gain and (for dynamic flat-field correction) mean flat minus dark,
+# eigen flats and fit region of the worker processes, set once per process
+# by 'start_worker', so that we do not send them along with every chunk
+WorkerDark = None
+WorkerGain = None
+WorkerFlat = None
+WorkerEigenflats = None
+WorkerFitRegion = None
+
+
+def start_worker(dark, gain, flat=None, eigenflats=None, fitregion=None):
+    global WorkerDark, WorkerGain, WorkerFlat, WorkerEigenflats, \
+        WorkerFitRegion
+    WorkerDark = dark
+    WorkerGain = gain
+    WorkerFlat = flat
+    WorkerEigenflats = eigenflats
+    WorkerFitRegion = fitregion
+
+
+def correct_chunk(arguments):
+    """
+    Read one chunk of projections, correct it and write it as chunk 'number'
+    of the projection stack in 'directory'. Runs in a separate process.
+    """
+    filenames, directory, number, width, height = arguments
+    projections = read_raw_stack(filenames, width=width, height=height)
+    if WorkerEigenflats is None:
+        gain = WorkerGain
+    else:
+        gain = dynamic_gain(projections, WorkerDark, WorkerFlat,
+                            WorkerEigenflats, fitregion=WorkerFitRegion)
+    write_chunk(directory, number, correct(projections, WorkerDark, gain))
+    return number
+
+
+def image_metadata(filename):
+    """
+    Metadata of one projection, as we save it in the ProjectionStack
+    """
+    try:
+        source, voltage, current, exposure = parse_settings(filename)
+    except (IndexError, ValueError):
+        voltage, current, exposure = None, None, None
+    return {'name': os.path.basename(filename), 'voltage': voltage,
+            'current': current, 'exposure': exposure}
+
+
+def correct_projections(filenames, dark, flat, stack, chunksize=8,
+                        width=2048, height=1024, processes=None,
+                        eigenflats=None, fitregion=None, verbose=False):
+    """
+    Flat-field correct all the .raw projections in 'filenames' and append
+    them to the ProjectionStack 'stack', as float32 chunks of 'chunksize'
+    images, together with voltage, current and exposure time.
+    If we get 'eigenflats', we do a dynamic flat-field correction, where the
+    flat of each projection is fitted in 'fitregion' (see dynamic_gain). The
+    eigen flats are centered on the mean flat, so 'flat' then has to be the
+    mean flat returned by 'eigenflats', not a median or sigma-clipped one.
+    The chunks are read and corrected in a pool of processes, which write
+    their results directly to disk. The function returns the stack.
+    """
+    if eigenflats is not None and fitregion is None:
+        raise ValueError('The dynamic flat-field correction needs a fit '
+                         'region without sample')
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    dark = numpy.asarray(dark, dtype=numpy.float32)
+    gain = flatfield_gain(dark, flat)
+    flat = numpy.subtract(flat, dark, dtype=numpy.float32)
+    chunks = [(filenames[start:start + chunksize], stack.directory,
+               len(stack.chunks) + counter, width, height)
+              for counter, start in enumerate(range(0, len(filenames),
+                                                    chunksize))]
+    pool = multiprocessing.Pool(processes, initializer=start_worker,
+                                initargs=(dark, gain, flat, eigenflats,
+                                          fitregion))
+    try:
+        done = 0
+        for counter, number in enumerate(pool.imap(correct_chunk, chunks)):
+            stack.register_chunk(number, [image_metadata(f) for f in
+                                          chunks[counter][0]])
+            done += len(chunks[counter][0])
+            if verbose:
+                print '\tCorrected %s/%s projections' % (done,
+                                                        len(filenames))
+    finally:
+        pool.close()
+        pool.join()
+    return stack
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watch the folders the acquisition scripts write into, and hand each image to
+an analysis function as soon as the ShadoBox has completely written it.
+An image is complete when its .raw file has the full size of a frame, files
+which are still being written are picked up on one of the next polls.
+"""
+
+import glob
+import os
+import time
+
+# Size of one complete frame from the ShadoBox, 16 bit per pixel
+FrameSize = 2048 * 1024 * 2
+
+
+def complete_frames(folder, expectedsize=FrameSize):
+    """
+    All .raw files in 'folder' which have the size of a complete frame,
+    oldest first
+    """
+    frames = []
+    for filename in glob.glob(os.path.join(folder, '*.raw')):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # Removed in the meantime
+            continue
+        if stat.st_size == expectedsize:
+            frames.append((stat.st_mtime, filename))
+    return [filename for mtime, filename in sorted(frames)]
+
+
+class FrameWatcher(object):
+    """
+    Poll 'folders' for new complete frames. Frames in 'seen' (e.g. the ones
+    we already analyzed in an earlier run) are not reported again.
+    """
+
+    def __init__(self, folders, expectedsize=FrameSize, seen=None):
+        self.folders = folders
+        self.expectedsize = expectedsize
+        self.seen = set(seen or [])
+
+    def poll(self):
+        """
+        Return the frames which have been completed since the last poll
+        """
+        new = []
+        for folder in self.folders:
+            for filename in complete_frames(folder, self.expectedsize):
+                if filename not in self.seen:
+                    self.seen.add(filename)
+                    new.append(filename)
+        return new
+
+    def watch(self, process, interval=5, idle=None, verbose=False):
+        """
+        Call process(filename) for each new frame, until no new frame came
+        in for 'idle' seconds (or forever if idle is None) or the user
+        presses Ctrl-C. Returns the number of frames we processed.
+        """
+        processed = 0
+        lastframe = time.time()
+        try:
+            while idle is None or time.time() - lastframe < idle:
+                new = self.poll()
+                for filename in new:
+                    if verbose:
+                        print '%s: Processing %s, written %0.1f s ago' % (
+                            processed + 1, os.path.basename(filename),
+                            time.time() - os.path.getmtime(filename))
+                    process(filename)
+                    processed += 1
+                if new:
+                    lastframe = time.time()
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            print 'Stopped watching after %s frames' % processed
+        return processed
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Catalog of all the images we acquired with the ShadoBox.
+Instead of walking the image folders (on the network file system) and
+parsing the voltage, current and exposure time from the file names in each
+script, we scan the folders once and keep the results in a structured numpy
+array, which is saved next to the data. On the next scan we only look again
+at the folders that changed since.
+"""
+
+import os
+import numpy
+
+from ERIfunctions import parse_settings, atomic_write
+from framewatcher import FrameSize
+
+# One entry per image
+CatalogType = numpy.dtype([('folder', 'S128'), ('name', 'S128'),
+                           ('source', 'S16'), ('phantom', 'S16'),
+                           ('voltage', 'i2'), ('current', 'i2'),
+                           ('exposure', 'i2'), ('size', 'i8'),
+                           ('mtime', 'f8')])
+# The phantoms we imaged, as found in the folder names
+Phantoms = ('Grid', 'Wrench', 'Current')
+
+
+def catalog_entry(folder, name, stat):
+    """
+    Make a catalog entry from the folder, file name and os.stat of an image.
+    Images which do not follow our naming scheme (e.g. the darks) get -1 for
+    voltage, current and exposure time.
+    """
+    try:
+        source, voltage, current, exposure = parse_settings(name)
+    except (IndexError, ValueError):
+        source, voltage, current, exposure = name.split('_')[0], -1, -1, -1
+    phantom = ''
+    for p in Phantoms:
+        if p in folder:
+            phantom = p
+    return (folder, name, source, phantom, voltage, current, exposure,
+            stat.st_size, stat.st_mtime)
+
+
+def scan(startpath, catalogfile=None, verbose=False):
+    """
+    Return the catalog of all .raw images in the folders in 'startpath'.
+    The catalog is read from 'catalogfile' (by default 'Catalog.npz' in
+    'startpath') and only the folders whose modification time changed since
+    the last scan (i.e. where images have been added, removed or renamed) are
+    read again from disk. A file which grows in place does not change the
+    modification time of its folder, so in the other folders we look again
+    at all images which were smaller than a complete frame.
+    The updated catalog is saved back to 'catalogfile', if we can write it.
+    """
+    if catalogfile is None:
+        catalogfile = os.path.join(startpath, 'Catalog.npz')
+    images = numpy.empty(0, dtype=CatalogType)
+    foldermtimes = {}
+    if os.path.exists(catalogfile):
+        with numpy.load(catalogfile) as stored:
+            images = stored['images']
+            foldermtimes = dict(zip(stored['folders'],
+                                    stored['foldermtimes']))
+    updated = False
+    entries = []
+    newfoldermtimes = {}
+    for folder in sorted(os.listdir(startpath)):
+        if not os.path.isdir(os.path.join(startpath, folder)):
+            continue
+        mtime = os.stat(os.path.join(startpath, folder)).st_mtime
+        newfoldermtimes[folder] = mtime
+        known = images[images['folder'] == folder]
+        if foldermtimes.get(folder) == mtime:
+            folderentries = []
+            for entry in known:
+                if entry['size'] == FrameSize:
+                    folderentries.append(entry)
+                    continue
+                # Still being written when we last looked at it
+                try:
+                    stat = os.stat(os.path.join(startpath, folder,
+                                                entry['name']))
+                except OSError:
+                    updated = True
+                    continue
+                if entry['size'] == stat.st_size and \
+                        entry['mtime'] == stat.st_mtime:
+                    folderentries.append(entry)
+                else:
+                    updated = True
+                    folderentries.append(catalog_entry(folder, entry['name'],
+                                                       stat))
+            entries.append(numpy.array(folderentries, dtype=CatalogType))
+            continue
+        if verbose:
+            print 'Updating catalog for folder %s' % folder
+        updated = True
+        known = dict((entry['name'], entry) for entry in known)
+        folderentries = []
+        for name in sorted(os.listdir(os.path.join(startpath, folder))):
+            if not name.endswith('.raw'):
+                continue
+            stat = os.stat(os.path.join(startpath, folder, name))
+            if name in known and known[name]['size'] == stat.st_size and \
+                    known[name]['mtime'] == stat.st_mtime:
+                folderentries.append(known[name])
+            else:
+                folderentries.append(catalog_entry(folder, name, stat))
+        entries.append(numpy.array(folderentries, dtype=CatalogType))
+    if sorted(newfoldermtimes) != sorted(foldermtimes):
+        updated = True
+    if entries:
+        catalog = numpy.concatenate(entries)
+    else:
+        catalog = numpy.empty(0, dtype=CatalogType)
+    if updated:
+        foldernames = sorted(newfoldermtimes)
+        try:
+            with atomic_write(catalogfile) as outfile:
+                numpy.savez(outfile, images=catalog,
+                            folders=numpy.array(foldernames, dtype='S128'),
+                            foldermtimes=numpy.array(
+                                [newfoldermtimes[f] for f in foldernames]))
+        except (IOError, OSError):
+            # E.g. on a read-only mount, we then scan again next time
+            print 'Could not save the catalog to %s' % catalogfile
+    return catalog
+
+
+def select(catalog, folder=None, source=None, phantom=None, voltage=None,
+           current=None, exposure=None):
+    """
+    Select the images from the catalog which match all the given criteria.
+    """
+    selection = numpy.ones(len(catalog), dtype=bool)
+    for field, value in (('folder', folder), ('source', source),
+                         ('phantom', phantom), ('voltage', voltage),
+                         ('current', current), ('exposure', exposure)):
+        if value is not None:
+            selection &= catalog[field] == value
+    return catalog[selection]
+
+
+def folders(catalog):
+    """
+    Return the sorted names of the folders which contain images
+    """
+    return sorted(set(catalog['folder']))
+
+
+def filenames(catalog, startpath):
+    """
+    Return the full paths to the images in (a selection of) the catalog
+    """
+    return [os.path.join(startpath, entry['folder'], entry['name']) for entry
+            in catalog]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Everything we derive from one image (crops, statistics, line profiles, edge
+response, line spread function, MTF, ...), calculated only when we first ask
+for it and then kept for as long as we look at the image.
+The scripts ask the context of an image for what they need to plot, instead
+of calculating the same things again for each subplot.
+"""
+
+import numpy
+
+import lineprofiler
+import mtfengine
+from ERIfunctions import read_raw
+from imagestatistics import ImageStats
+
+
+class ImageContext(object):
+    """
+    Lazily calculated features of the image in 'filename'. Regions of
+    interest are given as roi = [top, bottom, left, right], line profiles as
+    coordinates = ((x0, y0), (x1, y1)).
+    """
+
+    def __init__(self, filename, defects=None, width=2048, height=1024):
+        self.filename = filename
+        self.defects = defects
+        self.width = width
+        self.height = height
+        self.features = {}
+
+    def feature(self, name, function, *args):
+        """
+        Return the feature 'name' for the arguments 'args', calculated with
+        function(*args) the first time we ask for it
+        """
+        key = (name, repr(args))
+        if key not in self.features:
+            self.features[key] = function(*args)
+        return self.features[key]
+
+    @property
+    def image(self):
+        """
+        The image, memory mapped so that crops only read their region
+        """
+        return self.feature('image', lambda: read_raw(
+            self.filename, width=self.width, height=self.height, memmap=True,
+            defects=self.defects))
+
+    def crop(self, roi):
+        return self.feature('crop', lambda roi: numpy.array(
+            self.image[roi[0]:roi[1], roi[2]:roi[3]], dtype=numpy.uint16),
+            roi)
+
+    def stats(self, roi=None):
+        """
+        ImageStats of the whole image or the region of interest
+        """
+        return self.feature('stats', lambda roi: ImageStats(
+            self.image if roi is None else self.crop(roi)), roi)
+
+    def profile(self, coordinates):
+        """
+        Line profile along the coordinates (from the disk cache if we have
+        seen the image before)
+        """
+        return self.feature('profile', lambda coordinates: (
+            lineprofiler.cached_lineprofile(
+                self.filename, coordinates, width=self.width,
+                height=self.height, defects=self.defects)[1]), coordinates)
+
+    def slanted_edge(self, roi):
+        """
+        Edge response, line spread function, its fit and the MTF of the
+        slanted edge in the region of interest (see mtfengine.SlantedEdge,
+        with one row for this image)
+        """
+        return self.feature('slanted_edge', lambda roi: mtfengine.SlantedEdge(
+            self.crop(roi)[numpy.newaxis]), roi)
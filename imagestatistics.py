@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Statistics of image series, calculated without keeping all the images in
+memory.
+"""
+
+import numpy
+
+from ERIfunctions import read_raw_stack
+
+
+class RunningStatistics(object):
+    """
+    Accumulate per-pixel mean, variance, minimum and maximum of a series of
+    images, together with the mean and STD of each single image, in one pass
+    and with constant memory.
+    Images can be added one by one or in chunks (N, height, width). Chunks are
+    merged into the running values with the parallel algorithm of Chan et
+    al., see http://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+        self.minimum = None
+        self.maximum = None
+        self._framemean = []
+        self._framestd = []
+
+    def add(self, images):
+        """
+        Add one image or a chunk of images to the statistics
+        """
+        images = numpy.asarray(images)
+        if images.ndim == 2:
+            images = images[numpy.newaxis]
+        if not len(images):
+            return
+        chunk = images.astype(numpy.float64)
+        chunkmean = numpy.mean(chunk, axis=0)
+        chunkm2 = numpy.sum((chunk - chunkmean) ** 2, axis=0)
+        self._framemean.extend(numpy.mean(chunk, axis=(1, 2)))
+        self._framestd.extend(numpy.std(chunk, axis=(1, 2)))
+        if not self.count:
+            self.count = len(chunk)
+            self._mean = chunkmean
+            self._m2 = chunkm2
+            self.minimum = numpy.min(images, axis=0)
+            self.maximum = numpy.max(images, axis=0)
+            return
+        total = self.count + len(chunk)
+        delta = chunkmean - self._mean
+        self._mean += delta * len(chunk) / total
+        self._m2 += chunkm2 + delta ** 2 * self.count * len(chunk) / total
+        self.count = total
+        self.minimum = numpy.minimum(self.minimum, numpy.min(images, axis=0))
+        self.maximum = numpy.maximum(self.maximum, numpy.max(images, axis=0))
+
+    @property
+    def mean(self):
+        """
+        Per-pixel mean, i.e. the average image
+        """
+        return self._mean
+
+    def variance(self, ddof=0):
+        """
+        Per-pixel variance, with 'ddof' like in numpy.var
+        """
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=0):
+        """
+        Per-pixel standard deviation, with 'ddof' like in numpy.std
+        """
+        return numpy.sqrt(self.variance(ddof=ddof))
+
+    @property
+    def framemean(self):
+        """
+        Mean (brightness) of each image we added
+        """
+        return numpy.array(self._framemean)
+
+    @property
+    def framestd(self):
+        """
+        Gray value STD of each image we added
+        """
+        return numpy.array(self._framestd)
+
+
+def image_statistics(filenames, chunksize=16, roi=None, verbose=False):
+    """
+    Calculate the RunningStatistics of a list of .raw files, reading only
+    'chunksize' images at once.
+    """
+    statistics = RunningStatistics()
+    for start in range(0, len(filenames), chunksize):
+        if verbose:
+            print '\tImages %s-%s of %s' % (
+                start + 1, min(start + chunksize, len(filenames)),
+                len(filenames))
+        statistics.add(read_raw_stack(filenames[start:start + chunksize],
+                                      roi=roi))
+    return statistics
+
+
+class ImageStats(object):
+    """
+    Exact statistics of an integer (e.g. 12 bit in uint16) image, all
+    calculated from one histogram of the gray values. Mean, STD, minimum,
+    maximum, median and any percentile are then read from the histogram,
+    without going through the pixels again.
+    If the user supplies a region of interest in the form of roi =
+    [top, bottom, left, right], we only look at this region. This also
+    works on memory mapped images from read_raw(..., memmap=True), where
+    only the region is read from disk.
+    """
+
+    def __init__(self, image, roi=None):
+        if roi is not None:
+            top, bottom, left, right = roi
+            image = image[top:bottom, left:right]
+        image = numpy.asarray(image)
+        if not numpy.issubdtype(image.dtype, numpy.integer):
+            raise ValueError('ImageStats only works on integer images, not '
+                             '%s' % image.dtype)
+        if not image.size:
+            raise ValueError('ImageStats needs at least one pixel')
+        self.histogram = numpy.bincount(numpy.ravel(image).astype(numpy.intp))
+        self.values = numpy.arange(len(self.histogram))
+        self.cumulative = numpy.cumsum(self.histogram)
+
+    @property
+    def count(self):
+        return self.cumulative[-1]
+
+    @property
+    def mean(self):
+        return numpy.dot(self.histogram, self.values) / float(self.count)
+
+    def variance(self, ddof=0):
+        """
+        Variance of the gray values, with 'ddof' like in numpy.var
+        """
+        return numpy.dot(self.histogram, (self.values - self.mean) ** 2) / \
+            float(self.count - ddof)
+
+    def std(self, ddof=0):
+        """
+        STD of the gray values, with 'ddof' like in numpy.std
+        """
+        return numpy.sqrt(self.variance(ddof=ddof))
+
+    @property
+    def min(self):
+        return numpy.flatnonzero(self.histogram)[0]
+
+    @property
+    def max(self):
+        return len(self.histogram) - 1
+
+    def value(self, rank):
+        """
+        Gray value of the pixel(s) at 'rank' in the sorted image
+        """
+        return numpy.searchsorted(self.cumulative, rank, side='right')
+
+    def percentile(self, q):
+        """
+        Percentile(s) of the gray values, interpolated linearly like
+        numpy.percentile
+        """
+        rank = numpy.asarray(q, dtype=numpy.float64) / 100 * (self.count - 1)
+        lower = self.value(numpy.floor(rank))
+        upper = self.value(numpy.ceil(rank))
+        return lower + (upper - lower) * (rank - numpy.floor(rank))
+
+    @property
+    def median(self):
+        return self.percentile(50)
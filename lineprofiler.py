@@ -4,6 +4,9 @@
 Line profile function used in several scripts.
 """
 
+from ERIfunctions import read_raw
+from memocache import memoize
+
 
 def lineprofile(inputimage, coordinates=False, showimage=False, debug=False):
     """
@@ -97,3 +100,18 @@ def lineprofile(inputimage, coordinates=False, showimage=False, debug=False):
         if debug:
             plt.show()
     return ((x0, y0), (x1, y1)), profileinterpolated
+
+
+@memoize()
+def cached_lineprofile(filename, coordinates, width=2048, height=1024,
+                       defects=None):
+    """
+    Line profile of the image in 'filename' along the given coordinates,
+    without showing anything. Same as lineprofile(read_raw(filename),
+    coordinates, showimage=False), but we keep the results in the disk cache.
+    The results are keyed on the path, size and modification time of the
+    file, so we only read the image if we have not seen it before.
+    """
+    return lineprofile(read_raw(filename, width=width, height=height,
+                                memmap=True, defects=defects), coordinates,
+                       showimage=False)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""
+Master dark and flat images, calculated from a whole series of darks or flats.
+"""
+
+import glob
+import hashlib
+import multiprocessing
+import os
+import numpy
+
+from ERIfunctions import read_raw_stack, parse_exposure, atomic_write
+
+
+def sigma_clipped_mean(stack, sigma=3, iterations=5):
+    """
+    Per-pixel mean of a (N, height, width) stack, where we iteratively reject
+    all values further than 'sigma' standard deviations from the median of
+    the remaining values, so that single zingers or source arcs do not end up
+    in the master image. The standard deviation is estimated from the median
+    absolute deviation: the mean and STD include the outlier itself, which
+    in a short series (N <= 10 for sigma=3) can then never be further than
+    'sigma' STDs away. We never clip closer than one gray value, since the
+    images only have integer values.
+    """
+    stack = stack.astype(numpy.float32)
+    remaining = stack
+    valid = numpy.ones(stack.shape, dtype=bool)
+    for i in range(iterations):
+        # nanmedian is much slower, we only need it once we rejected values
+        nanmedian = numpy.nanmedian if i else numpy.median
+        median = nanmedian(remaining, axis=0)
+        width = numpy.maximum(1.4826 * nanmedian(
+            numpy.abs(remaining - median), axis=0), 1)
+        clipped = numpy.abs(stack - median) <= sigma * width
+        if numpy.array_equal(clipped, valid):
+            break
+        valid = clipped
+        remaining = numpy.where(valid, stack, numpy.nan)
+    count = numpy.sum(valid, axis=0)
+    mean = numpy.sum(stack * valid, axis=0, dtype=numpy.float64) / \
+        numpy.maximum(count, 1)
+    # Should we have rejected everything, we take the plain mean
+    return numpy.where(count, mean, numpy.mean(stack, axis=0,
+                                               dtype=numpy.float64))
+
+
+def master_band(arguments):
+    """
+    Calculate one band of rows of the master image. Runs in a separate
+    process, which is why we get all the arguments in one tuple.
+    """
+    filenames, top, bottom, width, height, method, sigma = arguments
+    stack = read_raw_stack(filenames, roi=[top, bottom, 0, width],
+                           width=width, height=height)
+    if method == 'median':
+        return numpy.median(stack, axis=0)
+    elif method == 'sigmaclip':
+        return sigma_clipped_mean(stack, sigma=sigma)
+    else:
+        return numpy.mean(stack, axis=0)
+
+
+def master_frame(filenames, method='sigmaclip', sigma=3, width=2048,
+                 height=1024, memory=2 ** 30, processes=None, verbose=False):
+    """
+    Calculate the master image of a list of .raw files, with a per-pixel
+    'median', 'sigmaclip'ped mean or plain 'mean'.
+    We never load the whole series, but only bands of rows of all images,
+    which we process in parallel on all cores. The bands are chosen so that
+    all processes together use roughly 'memory' bytes.
+    """
+    if method not in ('median', 'sigmaclip', 'mean'):
+        raise ValueError('Unknown method "%s"' % method)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    # The sigma clipping needs a float32 copy and a mask on top of the
+    # uint16 stack
+    bytesperpixel = 2 + (9 if method == 'sigmaclip' else 0)
+    bandheight = memory // (processes * len(filenames) * width *
+                            bytesperpixel)
+    bandheight = int(min(max(bandheight, 1), height))
+    bands = [(filenames, top, min(top + bandheight, height), width, height,
+              method, sigma) for top in range(0, height, bandheight)]
+    if verbose:
+        print 'Calculating %s of %s images in %s bands of %s rows on %s ' \
+              'cores' % (method, len(filenames), len(bands), bandheight,
+                         processes)
+    pool = multiprocessing.Pool(processes)
+    try:
+        master = numpy.concatenate(pool.map(master_band, bands))
+    finally:
+        pool.close()
+        pool.join()
+    return master
+
+
+def cache_key(filenames, *parameters):
+    """
+    Hash the sorted file names, together with their size and modification
+    time, and some additional parameters. The key changes as soon as an image
+    is added, removed or overwritten.
+    """
+    key = hashlib.sha1()
+    for filename in sorted(filenames):
+        stat = os.stat(filename)
+        key.update('%s %s %s\n' % (os.path.abspath(filename), stat.st_size,
+                                    stat.st_mtime))
+    for parameter in parameters:
+        key.update('%s\n' % (parameter,))
+    return key.hexdigest()
+
+
+def cached_master_frame(filenames, method='sigmaclip', sigma=3, width=2048,
+                        height=1024, cachedir=None, verbose=False):
+    """
+    Same as master_frame, but we save the master image as .npy file in
+    'cachedir' (by default next to the images) and only recalculate it if the
+    set of images changed since.
+    """
+    if cachedir is None:
+        cachedir = os.path.dirname(os.path.abspath(filenames[0]))
+    key = cache_key(filenames, method, sigma, width, height)
+    cachefile = os.path.join(cachedir, 'Master-%s-%s.npy' % (method,
+                                                             key[:16]))
+    if os.path.exists(cachefile):
+        if verbose:
+            print 'Loading cached master image %s' % cachefile
+        return numpy.load(cachefile)
+    master = master_frame(filenames, method=method, sigma=sigma, width=width,
+                          height=height, verbose=verbose)
+    try:
+        with atomic_write(cachefile) as outfile:
+            numpy.save(outfile, master)
+        if verbose:
+            print 'Saved master image to %s' % cachefile
+    except (IOError, OSError):
+        print 'Could not save master image to %s' % cachefile
+    return master
+
+
+class DarkLibrary(object):
+    """
+    Master darks for all detector exposure times.
+    The darks in 'darkfolder' are grouped by the exposure time in their file
+    name ('_NNsExp', darks without it are grouped as 'None'). For exposure
+    times we have darks for, we return their (cached) master dark. For all
+    other exposure times we interpolate linearly in each pixel, from an
+    offset and a dark current map fitted to all master darks. If we cannot
+    interpolate, we fall back to the closest master dark.
+    """
+
+    def __init__(self, darkfolder, method='sigmaclip', verbose=False):
+        self.darkfolder = darkfolder
+        self.method = method
+        self.verbose = verbose
+        self.darks = {}
+        for filename in sorted(glob.glob(os.path.join(darkfolder, '*.raw'))):
+            self.darks.setdefault(parse_exposure(filename),
+                                  []).append(filename)
+        if not self.darks:
+            raise ValueError('No dark images found in %s' % darkfolder)
+
+    @property
+    def exposures(self):
+        """
+        Exposure times we have darks for
+        """
+        return sorted(e for e in self.darks if e is not None)
+
+    def master(self, exposure):
+        """
+        Master dark of the darks with exactly this exposure time
+        """
+        return cached_master_frame(self.darks[exposure], method=self.method,
+                                   verbose=self.verbose)
+
+    def model(self):
+        """
+        Per-pixel offset and dark current (per second of exposure time),
+        fitted to the master darks of all exposure times. The fit is cached
+        next to the darks, like the master darks.
+        """
+        if len(self.exposures) < 2:
+            raise ValueError('We need darks with at least two exposure '
+                             'times to interpolate, we only have %s' %
+                             self.exposures)
+        filenames = [f for e in self.exposures for f in self.darks[e]]
+        key = cache_key(filenames, self.method)
+        cachefile = os.path.join(self.darkfolder,
+                                 'DarkModel-%s-%s.npy' % (self.method,
+                                                          key[:16]))
+        if os.path.exists(cachefile):
+            return numpy.load(cachefile)
+        # Least squares fit of a line through all master darks, per pixel
+        times = numpy.array(self.exposures, dtype=numpy.float64)
+        meanmaster = numpy.mean([self.master(e) for e in self.exposures],
+                                axis=0)
+        darkcurrent = numpy.zeros(meanmaster.shape)
+        for exposure in self.exposures:
+            darkcurrent += (exposure - numpy.mean(times)) * (
+                self.master(exposure) - meanmaster)
+        darkcurrent /= numpy.sum((times - numpy.mean(times)) ** 2)
+        model = numpy.array([meanmaster - darkcurrent * numpy.mean(times),
+                             darkcurrent])
+        try:
+            with atomic_write(cachefile) as outfile:
+                numpy.save(outfile, model)
+        except (IOError, OSError):
+            print 'Could not save dark model to %s' % cachefile
+        return model
+
+    def dark(self, exposure):
+        """
+        Master dark for the given exposure time [s]
+        """
+        if exposure in self.darks:
+            return self.master(exposure)
+        if exposure is not None and len(self.exposures) >= 2:
+            if self.verbose:
+                print 'Interpolating dark for %s s exposure time from ' \
+                      'darks with %s s' % (exposure, self.exposures)
+            offset, darkcurrent = self.model()
+            return offset + darkcurrent * exposure
+        if None in self.darks:
+            print 'No darks with %s s exposure time, using all darks ' \
+                  'without exposure time in their name' % exposure
+            return self.master(None)
+        # We cannot interpolate, so the closest master dark is the best we
+        # have
+        if exposure is None:
+            nearest = self.exposures[0]
+        else:
+            nearest = min(self.exposures, key=lambda e: abs(e - exposure))
+        print 'Warning: No darks with %s s exposure time, using the master ' \
+              'dark with %s s instead' % (exposure, nearest)
+        return self.master(nearest)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+Disk cache for the results of expensive analysis functions (e.g. line
+profiles).
+The functions we decorate with 'memoize' only depend on the images and their
+parameters, so we key their results on a hash of both and keep them as
+pickles on disk. Images are best passed as file names, which we identify by
+their path, size and modification time, instead of hashing their pixels on
+every call. When a script is run again over the same
+images, we just load the results from the last run.
+The cache is capped in size, if it grows too large, we remove the results we
+have not used for the longest time.
+"""
+
+import collections
+import cPickle
+import functools
+import hashlib
+import os
+import numpy
+
+from ERIfunctions import atomic_write, make_directory
+
+
+def argument_key(value):
+    """
+    String which identifies an argument of a memoized function. Arrays are
+    identified by their content, names of existing files by their absolute
+    path, size and modification time and everything else by its repr.
+    """
+    if isinstance(value, numpy.ndarray):
+        digest = hashlib.sha1()
+        digest.update(numpy.ascontiguousarray(value))
+        return 'array %s %s %s' % (value.dtype.str, value.shape,
+                                   digest.hexdigest())
+    if isinstance(value, basestring) and os.path.isfile(value):
+        stat = os.stat(value)
+        return 'file %s %s %s' % (os.path.abspath(value), stat.st_size,
+                                  stat.st_mtime)
+    if isinstance(value, (list, tuple)):
+        return '(%s)' % ', '.join(argument_key(v) for v in value)
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, argument_key(value[k])) for
+                                  k in sorted(value))
+    return repr(value)
+
+
+class DiskCache(object):
+    """
+    Directory of pickled results, with at most 'maxsize' bytes. Every time we
+    use a result, we touch its file, so the modification times tell us which
+    results were used least recently. We count the hits and misses for each
+    function.
+    """
+
+    def __init__(self, directory, maxsize=2 ** 30):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        # Total size of the cache, we only look at the directory the first
+        # time we need it and then keep track of what we add
+        self.total = None
+
+    def filename(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pickle')
+
+    def get(self, key):
+        """
+        Return (True, result) if we have the result for 'key' and (False,
+        None) if not
+        """
+        try:
+            with open(self.filename(key), 'rb') as cachefile:
+                result = cPickle.load(cachefile)
+        except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+            return False, None
+        try:
+            # Mark the result as recently used
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+        return True, result
+
+    def put(self, key, result):
+        """
+        Save a result and make room for it if the cache is too large
+        """
+        filename = self.filename(key)
+        try:
+            make_directory(os.path.dirname(filename))
+            with atomic_write(filename) as cachefile:
+                cPickle.dump(result, cachefile, cPickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            print 'Could not save result to %s' % filename
+            return
+        if self.total is None:
+            self.total = self.size()
+        else:
+            self.total += os.path.getsize(filename)
+        if self.total > self.maxsize:
+            self.evict()
+
+    def entries(self):
+        """
+        List of (modification time, size, filename) of all cached results
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pickle'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        # Removed in the meantime
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size,
+                                    os.path.join(root, name)))
+        return entries
+
+    def size(self):
+        return sum(size for mtime, size, name in self.entries())
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is smaller
+        than 'maxsize'
+        """
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(name)
+            except OSError:
+                # Already removed by somebody else
+                pass
+            total -= size
+        self.total = total
+
+    def clear(self):
+        for mtime, size, name in self.entries():
+            os.remove(name)
+        self.total = 0
+
+    def report(self):
+        """
+        Print the hits and misses of all functions we have seen
+        """
+        for name in sorted(set(self.hits) | set(self.misses)):
+            print '%s: %s hits, %s misses' % (name, self.hits[name],
+                                              self.misses[name])
+
+# By default, we cache everything in the home directory of the user
+Cache = DiskCache(os.path.join(os.path.expanduser('~'), '.ERI-cache'))
+
+
+def memoize(version=1, cache=None):
+    """
+    Decorator which caches the results of a function in 'cache' (by default
+    the global 'Cache' from above, which can be pointed somewhere else). If
+    we change what a function calculates, we increase its 'version', so that
+    we do not get the old results anymore.
+    """
+    def decorator(function):
+        name = '%s.%s' % (function.__module__, function.__name__)
+
+        @functools.wraps(function)
+        def memoized(*args, **kwargs):
+            usedcache = Cache if cache is None else cache
+            key = hashlib.sha1('%s %s %s %s' % (
+                name, version, argument_key(args),
+                argument_key(kwargs))).hexdigest()
+            found, result = usedcache.get(key)
+            if found:
+                usedcache.hits[name] += 1
+                return result
+            usedcache.misses[name] += 1
+            result = function(*args, **kwargs)
+            usedcache.put(key, result)
+            return result
+        return memoized
+    return decorator
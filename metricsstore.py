@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+Store for the numbers we calculate from the images (brightness, STD, line
+profiles, MTF curves, ...), so that we do not need to recalculate them from
+the .raw files for each new comparison plot.
+All values are kept in a SQLite database, keyed by image, analysis and the
+version of the analysis. Together with the settings of each image from the
+catalog we can then ask for things like 'mean brightness vs. kV for ERI'.
+Images are keyed by their full path. Since the images are moved from the
+folder the acquisition writes into (where WatchAcquisition.py analyzes them)
+into the image folders, values of an image we already know under another
+path (same name, size and modification time) are taken over.
+"""
+
+import os
+import sqlite3
+import numpy
+
+
+class MetricsStore(object):
+    """
+    SQLite database with per-image scalar values and arrays
+    """
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY, folder TEXT, source TEXT,
+                phantom TEXT, voltage INTEGER, current INTEGER,
+                exposure INTEGER, size INTEGER, mtime REAL);
+            CREATE TABLE IF NOT EXISTS scalars (
+                path TEXT, analysis TEXT, version TEXT, name TEXT,
+                value REAL, PRIMARY KEY (path, analysis, version, name));
+            CREATE TABLE IF NOT EXISTS arrays (
+                path TEXT, analysis TEXT, version TEXT, name TEXT,
+                data BLOB, PRIMARY KEY (path, analysis, version, name));
+            ''')
+
+    def close(self):
+        self.connection.close()
+
+    def add_images(self, catalog, startpath):
+        """
+        Add (or update) the images of a catalog (see imagecatalog). If an
+        image changed on disk since we last saw it, all the values we stored
+        for it are removed. New images get the values we stored for the same
+        image under another path.
+        """
+        with self.connection:
+            for entry in catalog:
+                path = os.path.join(startpath, entry['folder'], entry['name'])
+                stored = self.connection.execute(
+                    'SELECT size, mtime FROM images WHERE path = ?',
+                    (path,)).fetchone()
+                if stored == (int(entry['size']), float(entry['mtime'])):
+                    continue
+                for table in ('scalars', 'arrays'):
+                    self.connection.execute(
+                        'DELETE FROM %s WHERE path = ?' % table, (path,))
+                if stored is None:
+                    self.take_over(path, int(entry['size']),
+                                   float(entry['mtime']))
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO images VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, entry['folder'], entry['source'],
+                     entry['phantom'], int(entry['voltage']),
+                     int(entry['current']), int(entry['exposure']),
+                     int(entry['size']), float(entry['mtime'])))
+
+    def take_over(self, path, size, mtime):
+        """
+        Copy the values of the same image (by name, size and modification
+        time) under another path to 'path'
+        """
+        for (other,) in self.connection.execute(
+                'SELECT path FROM images WHERE size = ? AND mtime = ?',
+                (size, mtime)).fetchall():
+            if os.path.basename(other) != os.path.basename(path):
+                continue
+            for table in ('scalars', 'arrays'):
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO %s SELECT ?, analysis, version, '
+                    'name, %s FROM %s WHERE path = ?' % (
+                        table, 'value' if table == 'scalars' else 'data',
+                        table), (path, other))
+            return
+
+    def store(self, path, analysis, version, scalars=None, arrays=None):
+        """
+        Store a dictionary of scalar values and a dictionary of arrays for
+        one image and analysis
+        """
+        with self.connection:
+            for name, value in (scalars or {}).items():
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO scalars VALUES (?, ?, ?, ?, ?)',
+                    (path, analysis, str(version), name, float(value)))
+            for name, value in (arrays or {}).items():
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO arrays VALUES (?, ?, ?, ?, ?)',
+                    (path, analysis, str(version), name, sqlite3.Binary(
+                        numpy.asarray(value, dtype=numpy.float64).tostring())))
+
+    def missing(self, paths, analysis, version):
+        """
+        Return the paths for which we have nothing stored for this analysis
+        """
+        done = set(row[0] for row in self.connection.execute(
+            'SELECT DISTINCT path FROM scalars WHERE analysis = ? AND '
+            'version = ? UNION SELECT DISTINCT path FROM arrays WHERE '
+            'analysis = ? AND version = ?',
+            (analysis, str(version), analysis, str(version))))
+        return [p for p in paths if p not in done]
+
+    def update(self, catalog, startpath, analysis, version, function,
+               verbose=False):
+        """
+        Calculate the analysis for all images of the catalog which we do not
+        have stored yet. 'function' gets the path of an image and returns a
+        dictionary of scalars and a dictionary of arrays.
+        """
+        self.add_images(catalog, startpath)
+        paths = [os.path.join(startpath, entry['folder'], entry['name']) for
+                 entry in catalog]
+        todo = self.missing(paths, analysis, version)
+        for counter, path in enumerate(todo):
+            if verbose:
+                print '%s/%s: Calculating %s for %s' % (
+                    counter + 1, len(todo), analysis, os.path.basename(path))
+            scalars, arrays = function(path)
+            self.store(path, analysis, version, scalars, arrays)
+
+    def values(self, paths, analysis, version, name):
+        """
+        Return the stored scalar 'name' for each of the paths (NaN if we do
+        not have it)
+        """
+        stored = dict(self.connection.execute(
+            'SELECT path, value FROM scalars WHERE analysis = ? AND '
+            'version = ? AND name = ?', (analysis, str(version), name)))
+        return numpy.array([stored.get(p, numpy.nan) for p in paths])
+
+    def array(self, path, analysis, version, name):
+        """
+        Return one stored array (None if we do not have it)
+        """
+        row = self.connection.execute(
+            'SELECT data FROM arrays WHERE path = ? AND analysis = ? AND '
+            'version = ? AND name = ?',
+            (path, analysis, str(version), name)).fetchone()
+        if row is None:
+            return None
+        return numpy.frombuffer(bytes(row[0]), dtype=numpy.float64)
+
+    def query(self, analysis, version, name, **settings):
+        """
+        Return voltage, current and value of the scalar 'name' of all images
+        matching the settings (folder, source, phantom, voltage, current,
+        exposure), sorted by voltage and current. E.g. the mean brightness
+        vs. kV for ERI is query('brightness', 1, 'mean', source='ERI').
+        """
+        sql = 'SELECT images.voltage, images.current, scalars.value FROM ' \
+              'scalars JOIN images ON scalars.path = images.path WHERE ' \
+              'scalars.analysis = ? AND scalars.version = ? AND ' \
+              'scalars.name = ?'
+        parameters = [analysis, str(version), name]
+        for field in sorted(settings):
+            if field not in ('folder', 'source', 'phantom', 'voltage',
+                             'current', 'exposure'):
+                raise ValueError('Cannot select images by "%s"' % field)
+            sql += ' AND images.%s = ?' % field
+            parameters.append(settings[field])
+        sql += ' ORDER BY images.voltage, images.current'
+        rows = self.connection.execute(sql, parameters).fetchall()
+        if not rows:
+            return numpy.array([]), numpy.array([]), numpy.array([])
+        voltage, current, value = zip(*rows)
+        return numpy.array(voltage), numpy.array(current), numpy.array(value)
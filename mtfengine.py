@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+Edge spread, line spread and modulation transfer functions of a whole sweep
+of slanted edge images at once.
+All crops of a sweep are stacked and go through each step together: one mean
+for all edge responses, one diff for all line spread functions, one Gaussian
+fit for all of them (in closed form, no iterative fitting which could fail)
+and one rfft for all MTFs. From the width of the fitted Gaussians we get the
+frequencies where the MTF drops to 50% and 10% (MTF50 and MTF10).
+"""
+
+import numpy
+
+# Pixel pitch of the ShadoBox [um]
+PixelSize = 48.
+
+
+def edge_responses(crops):
+    """
+    Edge spread functions of a stack of crops (N, rows, columns) with a
+    vertical edge, averaged along the columns
+    """
+    return numpy.mean(numpy.asarray(crops, dtype=numpy.float64), axis=1)
+
+
+def line_spread(edgeresponses):
+    """
+    Line spread functions, the derivatives of the edge spread functions
+    """
+    return numpy.abs(numpy.diff(edgeresponses, axis=-1))
+
+
+def gaussian(length, amplitude, center, sigma):
+    """
+    Gaussian curves on range(length), for one or arrays of parameters
+    """
+    x = numpy.arange(length)
+    amplitude, center, sigma = [numpy.asarray(p, dtype=numpy.float64)[
+        ..., numpy.newaxis] for p in (amplitude, center, sigma)]
+    return amplitude * numpy.exp(-(x - center) ** 2 / (2. * sigma ** 2))
+
+
+def gaussian_moments(lsf, window=15):
+    """
+    Amplitude, center and width of the line spread functions (N, length) from
+    their moments, calculated in a 'window' around their centroid. The
+    background (the median) is subtracted first, so that the noise in the
+    tails does not widen the peak.
+    """
+    lsf = numpy.atleast_2d(lsf)
+    x = numpy.arange(lsf.shape[-1])
+    signal = numpy.clip(lsf - numpy.median(lsf, axis=-1)[:, numpy.newaxis],
+                        0, None)
+    # The centroid is less affected by noise than the maximum, especially
+    # for broad peaks
+    centroid = numpy.sum(signal * x, axis=-1) / numpy.maximum(
+        numpy.sum(signal, axis=-1), 1e-12)
+    signal = signal * (numpy.abs(x - centroid[:, numpy.newaxis]) <= window)
+    total = numpy.maximum(numpy.sum(signal, axis=-1), 1e-12)
+    center = numpy.sum(signal * x, axis=-1) / total
+    sigma = numpy.sqrt(numpy.sum(signal * (x - center[:, numpy.newaxis]) ** 2,
+                                 axis=-1) / total)
+    return numpy.max(signal, axis=-1), center, sigma
+
+
+def significant_edge(edgeresponses, threshold=10):
+    """
+    Which of the edge spread functions (N, length) have an edge, i.e. a step
+    between the gray values of their first and last quarter which is larger
+    than 'threshold' times their noise. We estimate the noise from the
+    median absolute deviation of the differences between neighbouring
+    values. Without an edge in the crop, the LSF has no peak we could
+    measure. Single hot pixels give spikes in the LSF, but no step.
+    """
+    edgeresponses = numpy.atleast_2d(edgeresponses)
+    quarter = max(edgeresponses.shape[-1] // 4, 1)
+    step = numpy.abs(numpy.median(edgeresponses[:, -quarter:], axis=-1) -
+                     numpy.median(edgeresponses[:, :quarter], axis=-1))
+    differences = numpy.diff(edgeresponses, axis=-1)
+    noise = 1.4826 * numpy.median(numpy.abs(differences - numpy.median(
+        differences, axis=-1)[:, numpy.newaxis]), axis=-1) / numpy.sqrt(2)
+    return step > threshold * noise
+
+
+def gaussian_fit(lsf, window=15):
+    """
+    Fit a Gaussian to each of the line spread functions (N, length) and
+    return the amplitudes, centers and widths (sigma) [px].
+    We start from the moments and then fit a parabola to the logarithm of the
+    background-free LSF within 2.5 sigma of the center, weighted with the
+    squared LSF (Guo's method). This is a linear least squares problem, so we
+    solve it for all LSFs at once. Where it does not give a peak, we keep the
+    moments.
+    """
+    lsf = numpy.atleast_2d(numpy.asarray(lsf, dtype=numpy.float64))
+    amplitude, center, sigma = gaussian_moments(lsf, window)
+    signal = lsf - numpy.median(lsf, axis=-1)[:, numpy.newaxis]
+    # Centered on the moments, so that the normal equations are well
+    # conditioned
+    x = numpy.arange(lsf.shape[-1]) - center[:, numpy.newaxis]
+    use = (numpy.abs(x) <= numpy.maximum(2.5 * sigma, 2)[:, numpy.newaxis]) \
+        & (signal > 0)
+    weights = numpy.where(use, signal, 0) ** 2
+    logsignal = numpy.log(numpy.where(use, signal, 1))
+    powers = numpy.array([x ** 0, x, x ** 2])
+    normal = numpy.einsum('jnl,knl,nl->njk', powers, powers, weights)
+    right = numpy.einsum('jnl,nl->nj', powers, weights * logsignal)
+    # Only solve where we have enough points for a parabola
+    solvable = numpy.sum(use, axis=-1) >= 3
+    coefficients = numpy.zeros((len(lsf), 3))
+    if numpy.any(solvable):
+        normal = normal[solvable]
+        # Regularize (numerically) singular systems instead of failing
+        normal += 1e-12 * numpy.eye(3)
+        coefficients[solvable] = numpy.linalg.solve(
+            normal, right[solvable][..., numpy.newaxis])[..., 0]
+    a, b, c = coefficients.T
+    peaked = solvable & (c < 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        fitsigma = numpy.sqrt(-1 / (2 * c))
+        fitcenter = -b / (2 * c)
+        fitamplitude = numpy.exp(a - b ** 2 / (4 * c))
+    peaked &= numpy.isfinite(fitsigma) & numpy.isfinite(fitamplitude) & \
+        (numpy.abs(fitcenter) < window)
+    amplitude = numpy.where(peaked, fitamplitude, amplitude)
+    center = numpy.where(peaked, center + fitcenter, center)
+    sigma = numpy.where(peaked, fitsigma, sigma)
+    return amplitude, center, sigma
+
+
+def mtf(lsf):
+    """
+    Modulation transfer functions of the line spread functions (N, length)
+    and their frequencies [cycles/px], normalized to 1 at zero frequency
+    """
+    transform = numpy.abs(numpy.fft.rfft(lsf, axis=-1))
+    return numpy.fft.rfftfreq(numpy.shape(lsf)[-1]), \
+        transform / numpy.maximum(transform[..., :1], 1e-12)
+
+
+def mtf_frequency(sigma, level):
+    """
+    Frequency [cycles/px] where the MTF of a Gaussian LSF with width 'sigma'
+    [px] drops to 'level' (e.g. 0.5 for MTF50)
+    """
+    return numpy.sqrt(-numpy.log(level) / 2.) / (numpy.pi * numpy.asarray(
+        sigma))
+
+
+def linepairs(frequency, pixelsize=PixelSize):
+    """
+    Convert a frequency in cycles/px to line pairs per mm
+    """
+    return numpy.asarray(frequency) * 1000. / pixelsize
+
+
+class SlantedEdge(object):
+    """
+    ESF, LSF, Gaussian fit and MTF of a stack of crops (N, rows, columns)
+    around the slanted edge, e.g. from read_raw_stack(filenames,
+    roi=CropRegion). Everything is an array with one row per crop.
+    Crops without a (significant) edge are not 'valid', their fit, MTF, MTF50
+    and MTF10 are NaN.
+    """
+
+    def __init__(self, crops, pixelsize=PixelSize, window=15):
+        self.pixelsize = pixelsize
+        self.esf = edge_responses(crops)
+        self.lsf = line_spread(self.esf)
+        amplitude, center, sigma = gaussian_fit(self.lsf, window)
+        self.valid = significant_edge(self.esf) & (sigma > 0) & \
+            numpy.isfinite(sigma)
+        self.amplitude, self.center, self.sigma = [
+            numpy.where(self.valid, p, numpy.nan) for p in (amplitude, center,
+                                                            sigma)]
+        self.lsffit = gaussian(self.lsf.shape[-1], self.amplitude,
+                               self.center, self.sigma)
+        self.frequencies, self.mtf = mtf(self.lsffit)
+        self.mtf50 = mtf_frequency(self.sigma, 0.5)
+        self.mtf10 = mtf_frequency(self.sigma, 0.1)
+
+    def linepairs(self, frequency):
+        """
+        'frequency' [cycles/px] in line pairs per mm
+        """
+        return linepairs(frequency, self.pixelsize)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Binned previews of the .raw images, for plotting.
+The first time we look at an image, we bin it by 2, 4 and 8 and save the
+binned images in a 'Previews' folder next to it. Plots then only load the
+binned image which fits the size of their axes, instead of reading and
+rendering the full image again.
+"""
+
+import hashlib
+import os
+import numpy
+import matplotlib.pylab as plt
+
+from ERIfunctions import read_raw, display_image, atomic_write, \
+    make_directory
+from masterframes import cache_key
+
+# Binning factors we keep previews for
+Levels = (2, 4, 8)
+
+
+def bin_image(image, factor):
+    """
+    Average 'factor' x 'factor' pixels of the image into one
+    """
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+    binned = numpy.mean(numpy.reshape(image[:height, :width], (
+        height // factor, factor, width // factor, factor)), axis=(1, 3))
+    return numpy.round(binned).astype(numpy.uint16)
+
+
+def defects_key(defects):
+    """
+    Hash of the defective pixels and their replacements from
+    defectpixels.defect_replacement, so that the previews change as soon as
+    the defect map does
+    """
+    if defects is None:
+        return None
+    key = hashlib.sha1()
+    for pixels in defects:
+        for coordinates in pixels:
+            key.update(numpy.ascontiguousarray(coordinates,
+                                               dtype=numpy.int64).tostring())
+    return key.hexdigest()
+
+
+def preview(filename, level=2, cachedir=None, defects=None, width=2048,
+            height=1024):
+    """
+    Return the image binned by 'level' (1 gives the full image). The previews
+    are cached in 'cachedir' (by default in 'Previews' next to the image),
+    keyed on the name, size and modification time of the image and on the
+    defective pixels we replace.
+    """
+    if level == 1:
+        return read_raw(filename, width=width, height=height, defects=defects)
+    if level not in Levels:
+        raise ValueError('We only have previews binned by %s' % (Levels,))
+    if cachedir is None:
+        cachedir = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                                'Previews')
+    key = cache_key([filename], width, height, defects_key(defects))
+    cachefile = os.path.join(cachedir, '%s.%s.npz' % (
+        os.path.splitext(os.path.basename(filename))[0], key[:16]))
+    if os.path.exists(cachefile):
+        with numpy.load(cachefile) as stored:
+            return stored['level%s' % level]
+    image = read_raw(filename, width=width, height=height, defects=defects)
+    previews = dict(('level%s' % f, bin_image(image, f)) for f in Levels)
+    try:
+        make_directory(cachedir)
+        with atomic_write(cachefile) as outfile:
+            numpy.savez(outfile, **previews)
+    except (IOError, OSError):
+        print 'Could not save preview to %s' % cachefile
+    return previews['level%s' % level]
+
+
+def level_for_axes(axes, width=2048):
+    """
+    Largest binning which still has at least as many pixels as the axes
+    """
+    pixels = axes.get_window_extent().width
+    level = 1
+    for factor in Levels:
+        if width / float(factor) >= pixels:
+            level = factor
+    return level
+
+
+def show_preview(filename, axes=None, defects=None, width=2048, height=1024,
+                 **kwargs):
+    """
+    Show the preview of an image which fits the axes (by default the current
+    ones), contrast stretched with display_image (which gets all additional
+    keyword arguments). The preview is shown in the coordinates of the full
+    image, so that we can draw on it as before.
+    """
+    if axes is None:
+        axes = plt.gca()
+    image = preview(filename, level=level_for_axes(axes, width=width),
+                    defects=defects, width=width, height=height)
+    return axes.imshow(display_image(image, **kwargs), vmin=0, vmax=255,
+                       extent=(-0.5, width - 0.5, height - 0.5, -0.5))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk container for stacks of (corrected) projections.
+The stack is a directory with the images in chunks of uncompressed .npy
+files and an 'index.json' describing the chunks and the voltage, current and
+exposure time of each image. Later steps can memory map the chunks directly,
+without decoding anything, and new images can be appended at any time.
+"""
+
+import bisect
+import json
+import os
+import shutil
+import numpy
+
+from ERIfunctions import atomic_write, make_directory
+
+
+def chunk_filename(directory, number):
+    return os.path.join(directory, 'Chunk%05d.npy' % number)
+
+
+def write_chunk(directory, number, images):
+    """
+    Save a (N, height, width) chunk of images as .npy file in the stack
+    directory. This is split from the ProjectionStack so that we can write
+    chunks from other processes, too.
+    """
+    with atomic_write(chunk_filename(directory, number)) as outfile:
+        numpy.save(outfile, numpy.asarray(images))
+
+
+class ProjectionStack(object):
+    """
+    A stack of images, saved in chunks in 'directory'. With overwrite=True we
+    start a new stack, otherwise we continue with the one already there.
+    """
+
+    def __init__(self, directory, overwrite=False):
+        self.directory = directory
+        if overwrite and os.path.exists(directory):
+            shutil.rmtree(directory)
+        make_directory(directory)
+        self.chunks = []
+        self.images = []
+        if os.path.exists(self.indexfile):
+            with open(self.indexfile) as indexfile:
+                index = json.load(indexfile)
+            self.chunks = index['chunks']
+            self.images = index['images']
+        self._maps = {}
+
+    @property
+    def indexfile(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _starts(self):
+        """
+        Index of the first image of each chunk
+        """
+        return list(numpy.cumsum([0] + [c['count'] for c in self.chunks]))
+
+    def register_chunk(self, number, metadata):
+        """
+        Add a chunk file which has been written with write_chunk to the
+        index, together with a list of the metadata (a dictionary with
+        'name', 'voltage', 'current' and 'exposure') of its images.
+        """
+        self.chunks.append({'file': os.path.basename(
+            chunk_filename(self.directory, number)), 'count': len(metadata)})
+        self.images.extend(metadata)
+        with atomic_write(self.indexfile, 'w') as indexfile:
+            json.dump({'chunks': self.chunks, 'images': self.images},
+                      indexfile, indent=1)
+
+    def append(self, images, metadata):
+        """
+        Append a (N, height, width) chunk of images with their metadata
+        """
+        write_chunk(self.directory, len(self.chunks), images)
+        self.register_chunk(len(self.chunks), metadata)
+
+    def chunk(self, number):
+        """
+        Return the chunk 'number', memory mapped
+        """
+        if number not in self._maps:
+            self._maps[number] = numpy.load(
+                os.path.join(self.directory, self.chunks[number]['file']),
+                mmap_mode='r')
+        return self._maps[number]
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        """
+        Return image 'index', memory mapped
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Stack only has %s images' % len(self))
+        starts = self._starts()
+        number = bisect.bisect_right(starts, index) - 1
+        return self.chunk(number)[index - starts[number]]
+
+    def __iter__(self):
+        for number in range(len(self.chunks)):
+            for image in self.chunk(number):
+                yield image
+
+    def metadata(self, field):
+        """
+        Return one field ('voltage', 'current', 'exposure', 'name') of the
+        metadata of all images in the stack
+        """
+        return [image[field] for image in self.images]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wait until the source has settled, by looking at it with the detector.
+Instead of always sleeping for a fixed time after changing the source (or
+for hours while it warms up), we take short probe images and follow the
+mean brightness in a region of interest. As soon as the brightness does not
+drift anymore, we go on. The fixed time is kept as a ceiling, so we never
+wait longer than before.
+"""
+
+import os
+import time
+
+from ERIfunctions import read_raw, make_directory
+from imagestatistics import ImageStats
+
+
+class SettleDetector(object):
+    """
+    Decide when the source has settled, from probe images of the 'detector'
+    with 'probeexposure' seconds, saved (and removed again) in a 'Probes'
+    folder in 'directory'.
+    We keep a running mean of the brightness in 'roi' = [top, bottom, left,
+    right] over the last probes which agree with each other. A probe which
+    differs by more than 'tolerance' (relative) from this mean starts a new
+    run. As soon as 'stable' probes in a row agree, the source has settled.
+    We wait 'interval' seconds between the probes and at most 'ceiling'
+    seconds overall. Afterwards, the detector is set back to the
+    'exposure' [s] of the real images.
+    A probe takes its exposure plus the readout of a full frame, which we
+    measure. We only start a probe if it ends before the ceiling, and if
+    'stable' probes do not fit into the ceiling at all (see useful), looking
+    at the source cannot be faster than the fixed time, so we just wait for
+    the ceiling.
+    """
+
+    def __init__(self, detector, directory, exposure, probeexposure=0.5,
+                 roi=(412, 612, 924, 1124), tolerance=0.005, stable=2,
+                 interval=0, ceiling=5, log=None):
+        self.detector = detector
+        self.directory = os.path.join(directory, 'Probes')
+        self.exposure = exposure
+        self.probeexposure = probeexposure
+        self.roi = roi
+        self.tolerance = tolerance
+        self.stable = stable
+        self.interval = interval
+        self.ceiling = ceiling
+        self.log = log
+        # Measured time one probe takes, with the readout
+        self.cycletime = None
+
+    def probe(self):
+        """
+        Acquire one probe image and return its mean brightness in the roi
+        """
+        make_directory(self.directory)
+        self.detector.set_directory(self.directory)
+        self.detector.set_prefix('Probe')
+        start = time.time()
+        self.detector.acquire(1, 2)
+        self.cycletime = time.time() - start
+        filename = os.path.join(self.directory, 'Probe_01.raw')
+        brightness = ImageStats(read_raw(filename, memmap=True),
+                                roi=self.roi).mean
+        os.remove(filename)
+        return brightness
+
+    def useful(self):
+        """
+        Can the probes tell us that the source settled before the ceiling?
+        Besides the 'stable' probes themselves, we count the readout of the
+        last real image, which we have to wait for before we can probe (and
+        which otherwise overlaps with the settling). Before the first probe
+        we do not know how long one takes and assume they can.
+        """
+        if self.cycletime is None:
+            return True
+        readout = self.cycletime - self.probeexposure
+        return self.stable * self.cycletime + (self.stable - 1) * \
+            self.interval + readout < self.ceiling
+
+    def wait(self):
+        """
+        Wait until the source has settled, or for 'ceiling' seconds. Returns
+        True if it settled and False if we hit the ceiling.
+        """
+        start = time.time()
+        if not self.useful():
+            time.sleep(self.ceiling)
+            return False
+        mean = None
+        run = 0
+        probes = 0
+        settled = False
+        self.detector.set_exposure_time(self.probeexposure * 1000)
+        try:
+            while time.time() - start + (self.cycletime or
+                                         self.probeexposure) < self.ceiling:
+                brightness = self.probe()
+                probes += 1
+                if run and abs(brightness - mean) <= \
+                        self.tolerance * abs(mean):
+                    # Streaming update of the mean of the run
+                    run += 1
+                    mean += (brightness - mean) / run
+                else:
+                    run = 1
+                    mean = brightness
+                if run >= self.stable:
+                    settled = True
+                    break
+                if self.interval:
+                    time.sleep(min(self.interval, max(
+                        self.ceiling - (time.time() - start), 0)))
+            else:
+                # Sleep for whatever is left of the ceiling
+                time.sleep(max(self.ceiling - (time.time() - start), 0))
+        finally:
+            self.detector.set_exposure_time(self.exposure * 1000)
+        if self.log:
+            self.log.info('%s after %0.1f s and %s probes (brightness %0.1f)',
+                          'Source settled' if settled else 'Source did not '
+                          'settle, waited for the maximum', time.time() -
+                          start, probes, mean if mean is not None else 0)
+            if not self.useful():
+                self.log.info('One probe takes %0.1f s, %s of them do not fit '
+                              'into %s s, we wait for the fixed time from '
+                              'now on', self.cycletime, self.stable,
+                              self.ceiling)
+        return settled
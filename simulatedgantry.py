@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-ins for the ShadoBox detector ('sb') and the Hamamatsu tube ('tube')
+from gantry_control, so that we can run and time the acquisition scripts
+without the hardware. Every command takes about as long as on the real
+hardware, and the detector writes .raw files with the size of real images.
+Like the real source, the simulated tube does not jump to a new setting, but
+ramps and drifts towards it, it slowly gets brighter while it warms up and
+its intensity flickers a bit from image to image. The detector images a
+phantom (a slanted edge or a grid) with the dark offset, fixed pattern noise,
+hot pixels and photon noise of a real ShadoBox, and writes the .raw file
+bit by bit during the readout, like the real detector.
+Use it with 'from simulatedgantry import *' instead of 'from gantry_control
+import *'. All latencies are attributes of 'sb' and 'tube', so a script can
+set them (e.g. from acquisitionplan) before it starts.
+"""
+
+import os
+import time
+import numpy
+import scipy.ndimage
+
+
+class SimulatedTube(object):
+    """
+    Hamamatsu tube, where each command takes 'commandtime' seconds. After a
+    change, the tube ramps for 'rampvoltage' seconds per kV (or
+    'rampcurrent' seconds per uA) and then approaches the intensity of the
+    new setting with the time constant 'settletime' [s]. After switching it
+    on, the tube is 'warmupdrift' darker, which decays with the time
+    constant 'warmuptime'. On top of this, the intensity changes by 'drift'
+    (relative) per hour and flickers by 'flicker' (relative standard
+    deviation) from image to image. 'focalspot' is the blur [px] of its
+    focal spot on the detector.
+    """
+
+    # Gray value per second of exposure, per uA and per kV squared
+    Flux = 1e-3
+
+    def __init__(self, commandtime=0.2, settletime=0.5, rampvoltage=0,
+                 rampcurrent=0, warmuptime=1800, warmupdrift=0.05, drift=0,
+                 flicker=0, focalspot=1.5):
+        self.commandtime = commandtime
+        self.settletime = settletime
+        self.rampvoltage = rampvoltage
+        self.rampcurrent = rampcurrent
+        self.warmuptime = warmuptime
+        self.warmupdrift = warmupdrift
+        self.drift = drift
+        self.flicker = flicker
+        self.focalspot = focalspot
+        self.running = False
+        self.voltage = 0
+        self.current = 0
+        self.switchedon = time.time()
+        self.changed = time.time()
+        self.ramp = 0
+        self.startintensity = 0
+
+    def open_port(self):
+        time.sleep(self.commandtime)
+
+    def start(self):
+        time.sleep(self.commandtime)
+
+    def stop(self):
+        time.sleep(self.commandtime)
+
+    def on(self):
+        time.sleep(self.commandtime)
+        self.change()
+        self.running = True
+        self.switchedon = time.time()
+
+    def off(self):
+        time.sleep(self.commandtime)
+        self.change()
+        self.running = False
+
+    def set_voltage(self, voltage):
+        time.sleep(self.commandtime)
+        self.change(self.rampvoltage * abs(voltage - self.voltage))
+        self.voltage = voltage
+
+    def set_current(self, current):
+        time.sleep(self.commandtime)
+        self.change(self.rampcurrent * abs(current - self.current))
+        self.current = current
+
+    def change(self, ramp=0):
+        """
+        Start ramping and drifting from the intensity we have now
+        """
+        self.startintensity = self.intensity()
+        self.changed = time.time()
+        self.ramp = ramp
+
+    def target(self, when=None):
+        """
+        Gray value per second of exposure of the fully settled source at the
+        time 'when' (now by default)
+        """
+        if when is None:
+            when = time.time()
+        if not self.running:
+            return 0
+        return self.Flux * self.current * self.voltage ** 2 * (
+            1 - self.warmupdrift * numpy.exp(-(when - self.switchedon) /
+                                             self.warmuptime)) * (
+            1 + self.drift * (when - self.switchedon) / 3600.)
+
+    def intensity(self, when=None):
+        """
+        Gray value per second of exposure at the time 'when' (now by default)
+        """
+        if when is None:
+            when = time.time()
+        target = self.target(when)
+        elapsed = when - self.changed
+        if elapsed < self.ramp:
+            # While ramping, we get halfway to the new setting
+            return self.startintensity + (target - self.startintensity) * \
+                0.5 * elapsed / self.ramp
+        start = self.startintensity
+        if self.ramp:
+            start += 0.5 * (target - self.startintensity)
+        return target + (start - target) * numpy.exp(
+            -(elapsed - self.ramp) / self.settletime)
+
+
+class SimulatedShadoBox(object):
+    """
+    ShadoBox detector, which needs 'exposureoverhead' seconds to start each
+    exposure and 'readouttime' seconds after it to read out and save the
+    image. The images show the 'phantom' ('edge', 'grid' or None for an
+    empty beam) lit by the 'source' during the exposure, blurred with its
+    focal spot. The contrast of the phantom drops with the voltage of the
+    source, and the beam gets darker towards one side (heel effect). Images
+    during whose exposure the source changed are noted in 'corrupted'.
+    The detector adds a dark 'offset' with fixed pattern noise of
+    'darknoise' gray values, 'hotpixels' hot pixels and photon noise. The
+    fixed pattern is the same for all images, like on the real detector.
+    """
+
+    def __init__(self, source=None, exposureoverhead=0, readouttime=0.5,
+                 offset=100, darknoise=0, hotpixels=0, phantom=None,
+                 heel=0.1, width=2048, height=1024, seed=0):
+        self.source = source
+        self.exposureoverhead = exposureoverhead
+        self.readouttime = readouttime
+        self.offset = offset
+        self.darknoise = darknoise
+        self.hotpixels = hotpixels
+        self.phantom = phantom
+        self.heel = heel
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.on = False
+        self.exposuretime = 1000
+        self.directory = '.'
+        self.prefix = 'image'
+        # Thickness maps of the phantoms and the dark image, we only make
+        # them once
+        self.cache = {}
+        # Images during whose exposure the source changed
+        self.corrupted = []
+
+    def start(self):
+        self.on = True
+
+    def stop(self):
+        self.on = False
+
+    def disconnect(self):
+        pass
+
+    def is_camera_on(self):
+        return self.on
+
+    def set_exposure_time(self, exposuretime):
+        """
+        Exposure time in ms, like the real detector
+        """
+        self.exposuretime = exposuretime
+
+    def set_directory(self, directory):
+        self.directory = directory
+
+    def set_prefix(self, prefix):
+        self.prefix = prefix
+
+    def dark(self):
+        """
+        Dark image of the detector, with fixed pattern noise and hot pixels
+        """
+        key = ('dark', self.offset, self.darknoise, self.hotpixels)
+        if key not in self.cache:
+            random = numpy.random.RandomState(self.seed)
+            dark = self.offset + random.normal(0, self.darknoise,
+                                               (self.height, self.width))
+            hot = random.randint(0, self.height * self.width,
+                                 self.hotpixels)
+            dark.flat[hot] = 2 ** 12 - 1
+            self.cache[key] = dark
+        return self.cache[key]
+
+    def thickness(self, blur):
+        """
+        Thickness map of the phantom, blurred by 'blur' pixels. The slanted
+        edge is tilted by 5 degrees, the grid has bars getting finer from
+        left to right.
+        """
+        key = (self.phantom, blur)
+        if key not in self.cache:
+            y, x = numpy.mgrid[:self.height, :self.width]
+            if self.phantom == 'edge':
+                thickness = (x - self.width / 2 >
+                             numpy.tan(numpy.radians(5)) *
+                             (y - self.height / 2)).astype(float)
+            elif self.phantom == 'grid':
+                # Bar widths from 32 down to 1 pixel, in eight columns
+                column = x * 8 // self.width
+                period = 2 * 2 ** (5 - column * 5 // 7)
+                thickness = ((x // (period // 2)) % 2).astype(float)
+                thickness[(y < self.height / 4) |
+                          (y > 3 * self.height / 4)] = 0
+            else:
+                thickness = numpy.zeros((self.height, self.width))
+            if blur:
+                thickness = scipy.ndimage.gaussian_filter(thickness, blur)
+            self.cache[key] = thickness
+        return self.cache[key]
+
+    def image(self, intensity, voltage):
+        """
+        The image we 'acquire' with the mean 'intensity' (gray value per
+        second of exposure) and 'voltage' of the source over the exposure, as
+        it is saved by the detector
+        """
+        signal = self.dark()
+        if intensity:
+            intensity = intensity * self.exposuretime / 1000.
+            flicker = getattr(self.source, 'flicker', 0)
+            if flicker:
+                intensity *= numpy.random.normal(1, flicker)
+            # Heel effect along the rows
+            beam = intensity * (1 + self.heel * (0.5 - numpy.arange(
+                self.width) / float(self.width)))
+            if self.phantom:
+                # The phantom absorbs less at higher voltages
+                attenuation = (40. / max(voltage, 1)) ** 2
+                beam = beam * numpy.exp(-attenuation * self.thickness(
+                    getattr(self.source, 'focalspot', 0)))
+            signal = signal + beam
+        image = numpy.random.normal(signal, numpy.sqrt(numpy.maximum(
+            signal, 1)), (self.height, self.width))
+        # 12 bit detector
+        return numpy.clip(numpy.round(image), 0, 2 ** 12 - 1).astype('>u2')
+
+    def expose(self):
+        """
+        Expose for 'exposuretime' and return the mean intensity and voltage
+        of the source over the exposure, which we follow while it happens.
+        If the source was changed during the exposure, the image is
+        corrupted, which we note.
+        """
+        steps = 20
+        start = time.time()
+        intensity = voltage = 0
+        for step in range(1, steps + 1):
+            time.sleep(max(start + step * self.exposuretime / 1000. / steps -
+                           time.time(), 0))
+            if self.source is not None:
+                now = self.source.intensity()
+                intensity += now / steps
+                voltage += now * self.source.voltage
+        changed = self.source is not None and self.source.changed > start
+        # Voltage weighted with the intensity, for the contrast
+        return intensity, voltage / max(intensity * steps, 1e-12), changed
+
+    def acquire(self, images, mode):
+        """
+        Expose and save 'images' images, as 'prefix_01.raw', ... The images
+        are written in chunks during the readout, so that other programs see
+        incomplete files like with the real detector. Images during whose
+        exposure the source was changed are added to 'corrupted'.
+        """
+        chunks = 8
+        for number in range(1, images + 1):
+            time.sleep(self.exposureoverhead)
+            intensity, voltage, changed = self.expose()
+            image = self.image(intensity, voltage)
+            filename = os.path.join(self.directory, '%s_%02d.raw' % (
+                self.prefix, number))
+            if changed:
+                print 'The source changed during the exposure of %s' % \
+                    filename
+                self.corrupted.append(filename)
+            with open(filename, 'wb') as rawfile:
+                for chunk in numpy.array_split(image, chunks):
+                    time.sleep(self.readouttime / float(chunks))
+                    chunk.tofile(rawfile)
+                    rawfile.flush()
+
+tube = SimulatedTube(drift=0.01, flicker=0.001)
+sb = SimulatedShadoBox(source=tube, darknoise=3, hotpixels=200,
+                       phantom='edge')